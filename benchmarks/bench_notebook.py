@@ -0,0 +1,214 @@
+""" Offline benchmarks for parsing, rendering and saving notebooks
+
+Runs the formatter and the display manager against the list-backed vim
+stand-in in this directory, on synthetic notebooks of growing size, and
+prints a JSON report with the time and peak python memory of each phase:
+
+    python benchmarks/bench_notebook.py [--sizes 10,1000] [--output report.json]
+
+"""
+import argparse
+import base64
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, here)
+sys.path.insert(1, os.path.join(here, os.pardir, "ftplugin", "python"))
+
+import vim
+import nbformat
+
+from vimipynbcellindex import on_lines_changed
+from vimipynbformatter import VimIpynbFormatter
+from vimjupyterdisplaymanager import VimJupterDisplayManager
+
+# mirror IpynbLinesChanged() in ftplugin/ipynb.vim
+vim.functions['IpynbLinesChanged'] = on_lines_changed
+
+default_sizes = [10, 100, 1000, 10000, 50000]
+
+
+class BenchShell():
+    """ Just enough of VimJupyterShell for update_from_buffer() """
+    kernel_info = {"language_info": {"name": "python",
+                                     "file_extension": ".py"}}
+    manager = None
+
+
+def make_notebook(n_cells, output_kb=0):
+    """ Alternate markdown and code cells, code cells get a stream output and
+    an image of output_kb kilobytes every tenth cell.
+    """
+    nb = nbformat.v4.new_notebook()
+    nb.metadata["language_info"] = {"name": "python"}
+    image = base64.b64encode(os.urandom(output_kb * 768)).decode('ascii')
+    for n in range(n_cells):
+        if n % 2 == 0:
+            nb.cells.append(nbformat.v4.new_markdown_cell(
+                "## Section {0}\n\nSome text for section {0}.".format(n)))
+            continue
+        cell = nbformat.v4.new_code_cell(
+            "import math\nx{0} = math.sqrt({0})\nfor i in range(3):\n"
+            "    print(i, x{0})".format(n))
+        cell.outputs.append(nbformat.v4.new_output(
+            "stream", name="stdout", text="0 1.0\n1 1.0\n2 1.0\n"))
+        if output_kb and n % 20 == 1:
+            cell.outputs.append(nbformat.v4.new_output(
+                "display_data", data={"image/png": image,
+                                      "text/plain": "<Figure>"}))
+        nb.cells.append(cell)
+    return nb
+
+
+def measure(phase, func, results, trace, **info):
+    """ Time func, or record its peak python memory if trace is set.
+    tracemalloc slows allocations down a lot, so both are never measured in
+    the same run.
+    """
+    gc.collect()
+    if trace:
+        tracemalloc.start()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results.append(dict(info, phase=phase, peak_bytes=peak))
+    else:
+        tic = time.perf_counter()
+        func()
+        seconds = time.perf_counter() - tic
+        results.append(dict(info, phase=phase, seconds=round(seconds, 6)))
+
+
+def bench_notebook(n_cells, output_kb, workdir, results, trace=False):
+    path = os.path.join(workdir, "bench-{0}-{1}.ipynb".format(
+        n_cells, output_kb))
+    with open(path, "w") as f:
+        nbformat.write(make_notebook(n_cells, output_kb), f)
+    info = dict(cells=n_cells, output_kb=output_kb,
+                file_bytes=os.path.getsize(path))
+
+    vim.new_buffer(path)
+    formatter = VimIpynbFormatter()
+
+    measure("open", formatter.read_ipynb, results, trace, **info)
+    measure("convert", formatter.to_buffer, results, trace, **info)
+    measure("parse", formatter.cells_from_buffer, results, trace, **info)
+
+    def edit_reparse():
+        names = [cell.name for cell in formatter.vim_ipynb_cells
+                 if cell.cell_type == "code"]
+        entry = formatter.cell_index.find(names[len(names) // 2])
+        formatter.nb_buffer[entry.begin + 1] = "import cmath"
+        formatter.cells_from_buffer()
+    measure("edit_reparse", edit_reparse, results, trace, **info)
+
+    formatter.shell = BenchShell()
+    measure("save", formatter.to_ipynb, results, trace, **info)
+
+    def save_edit():
+        entry = formatter.cell_index.find("markdown1")
+        formatter.nb_buffer[entry.begin + 1] = "# Edited"
+        formatter.to_ipynb()
+    measure("save_edit", save_edit, results, trace, **info)
+
+    def output_append():
+        display_manager = VimJupterDisplayManager()
+        display_manager.stdout_buffer = vim.Buffer("output", 0)
+        msg = {"header": {"msg_type": "stream"},
+               "content": {"name": "stdout", "text": "step done\n"}}
+        try:
+            for cell in formatter.vim_ipynb_cells:
+                if cell.cell_type == "code":
+                    display_manager.handle_stdout(msg["content"]["text"])
+                    formatter.embed_output(cell.name, msg)
+            # lines are written to the buffer by frames, the last one too
+            display_manager.render_frame(force=True)
+        finally:
+            display_manager.close()
+    measure("output_append", output_append, results, trace, **info)
+
+    check_saved(formatter)
+    formatter.cell_index.detach()
+    os.remove(path)
+
+
+def check_saved(formatter):
+    """ Save the notebook with its cells executed and validate the file, the
+    benchmark stops on a notebook nbformat would reject
+    """
+    stamp = "2024-01-01T00:00:00.000000Z"
+    for cell in formatter.vim_ipynb_cells:
+        if cell.cell_type == "code":
+            formatter.set_execution(cell.name, {
+                "vim-ipynb.submitted": stamp,
+                "iopub.status.busy": stamp,
+                "shell.execute_reply.started": stamp,
+                "shell.execute_reply": stamp,
+                "vim-ipynb.done": stamp}, 10)
+    formatter.to_ipynb()
+    nbformat.validate(nbformat.read(formatter.nb_buffer.name, as_version=4))
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=here,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default=",".join(map(str, default_sizes)),
+                        help="comma separated cell counts")
+    parser.add_argument("--output-kb", type=int, default=64,
+                        help="size of the large image outputs in kilobytes")
+    parser.add_argument("--eager-load", action="store_true",
+                        help="decode outputs on open, g:ipynb_lazy_outputs=0")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="skip the second run measuring peak memory")
+    parser.add_argument("--output", default="-",
+                        help="report file, '-' for stdout")
+    args = parser.parse_args(argv)
+    vim.vars["ipynb_lazy_outputs"] = 0 if args.eager_load else 1
+
+    results = []
+    passes = [False] if args.no_memory else [False, True]
+    with tempfile.TemporaryDirectory() as workdir:
+        for n_cells in [int(size) for size in args.sizes.split(",")]:
+            for output_kb in (0, args.output_kb):
+                timed, traced = [], []
+                for trace in passes:
+                    bench_notebook(n_cells, output_kb, workdir,
+                                   traced if trace else timed, trace)
+                for n, result in enumerate(timed):
+                    if traced:
+                        result["peak_bytes"] = traced[n]["peak_bytes"]
+                    results.append(result)
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "nbformat": nbformat.__version__,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "results": results,
+    }
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=1)
+        sys.stdout.write("\n")
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+""" List-backed stand-in for Vim's python interface
+
+Only the parts used by the modules under ftplugin/python are provided:
+buffers, windows, vim.Function, vim.command and the vim.eval expressions
+the plugin sends. It lets the plugin run outside Vim for benchmarking.
+"""
+import re
+
+
+class Buffer():
+    """ A Vim buffer holding its lines in a python list """
+
+    def __init__(self, name="", number=1, lines=None):
+        self.name = name
+        self.number = number
+        self._lines = list(lines) if lines else [""]
+        self.options = {}
+        # b: variables
+        self.vars = {}
+        self.valid = True
+        # pending (start, end, added) changes for listener_flush()
+        self.changes = []
+
+    def __len__(self):
+        return len(self._lines)
+
+    def __iter__(self):
+        return iter(self._lines)
+
+    def __getitem__(self, key):
+        return self._lines[key]
+
+    def __setitem__(self, key, value):
+        nrow = len(self._lines)
+        if isinstance(key, slice):
+            start, stop, _ = key.indices(nrow)
+            stop = max(start, stop)
+            new = [] if value is None else list(value)
+            self._lines[start:stop] = new
+        else:
+            start = key if key >= 0 else key + nrow
+            stop = start + 1
+            if value is None:
+                new = []
+                del self._lines[start]
+            else:
+                new = [value]
+                self._lines[start] = value
+        if not self._lines:
+            # a vim buffer always keeps one line
+            self._lines.append("")
+        self._changed(start, stop, len(new) - (stop - start))
+
+    def __delitem__(self, key):
+        self[key] = None
+
+    def append(self, lines, nr=None):
+        if isinstance(lines, str):
+            lines = [lines]
+        if nr is None:
+            nr = len(self._lines)
+        self._lines[nr:nr] = lines
+        self._changed(nr, nr, len(lines))
+
+    def _changed(self, start, stop, added):
+        if self.number in _listeners:
+            self.changes.append((start + 1, stop + 1, added))
+
+
+class Window():
+
+    def __init__(self, buffer, height=40, width=120):
+        self.buffer = buffer
+        self.cursor = (1, 0)
+        self.height = height
+        self.width = width
+
+
+class _Current():
+    buffer = None
+    window = None
+
+
+current = _Current()
+buffers = []
+# g: variables
+vars = {}
+# vim.command() history, for inspection
+commands = []
+# functions callable by name from listener_add(), set by the caller
+functions = {}
+
+_listeners = {}
+_next_listener = [1]
+# a: variables of the function being called
+_frame = {}
+# timer id -> callback name, run by the caller with run_timers()
+timers = {}
+
+
+def new_buffer(name="", lines=None):
+    """ Create a buffer and make it the current one """
+    buffer = Buffer(name, len(buffers) + 1, lines)
+    buffers.append(buffer)
+    current.buffer = buffer
+    current.window = Window(buffer)
+    return buffer
+
+
+def _find_buffer(number):
+    for buffer in buffers:
+        if buffer.number == number:
+            return buffer
+    return None
+
+
+def listener_flush(number):
+    buffer = _find_buffer(number)
+    if buffer is None or number not in _listeners:
+        return
+    func = functions.get(_listeners[number][1])
+    changes, buffer.changes = buffer.changes, []
+    for start, end, added in changes:
+        _frame.clear()
+        _frame.update(bufnr=number, start=start, end=end, added=added)
+        if func is not None:
+            func()
+    _frame.clear()
+
+
+def run_timers():
+    """ Call the callbacks of the running timers once """
+    for timer, func in list(timers.items()):
+        if func in functions:
+            functions[func]()
+
+
+def _cursor(row, col=0):
+    if isinstance(row, (list, tuple)):
+        row, col = row[0], row[1]
+    current.window.cursor = (row, col)
+    return 0
+
+
+_builtins = {
+    'bufwinid': lambda name: -1,
+    'win_gotoid': lambda wid: 1,
+    'cursor': _cursor,
+    'expand': lambda expr: b"",
+    'input': lambda prompt: b"",
+    'inputsecret': lambda prompt: b"",
+    'getline': lambda row: current.buffer[int(row) - 1],
+    'listener_flush': lambda number: listener_flush(int(number)),
+}
+
+
+class Function():
+
+    def __init__(self, name):
+        self.name = name
+
+    def __call__(self, *args):
+        func = _builtins.get(self.name)
+        if func is None:
+            return 0
+        return func(*args)
+
+
+def command(cmd):
+    commands.append(cmd)
+
+
+_call = re.compile(r"^(\w+)\((.*)\)$")
+
+
+def eval(expr):
+    expr = expr.strip()
+    if expr.startswith("a:"):
+        return str(_frame[expr[2:]])
+    if expr in ("exists('*listener_add')", "exists('*timer_start')"):
+        return "1"
+    if expr == "win_getid()":
+        return "1000"
+    if expr.startswith("@"):
+        return ""
+    match = _call.match(expr)
+    if match is None:
+        raise NotImplementedError(expr)
+    name, args = match.group(1), match.group(2)
+    if name == 'listener_add':
+        func, number = [a.strip().strip("'\"") for a in args.split(',')]
+        listener_id = _next_listener[0]
+        _next_listener[0] += 1
+        _listeners[int(number)] = (listener_id, func)
+        return str(listener_id)
+    if name == 'listener_remove':
+        for number, (listener_id, _) in list(_listeners.items()):
+            if listener_id == int(args):
+                del _listeners[number]
+        return "1"
+    if name == 'timer_start':
+        timer = len(timers) + 1
+        while timer in timers:
+            timer += 1
+        timers[timer] = args.split(',')[1].strip().strip("'\"")
+        return str(timer)
+    if name == 'timer_stop':
+        timers.pop(int(args), None)
+        return "0"
+    if name == 'listener_flush':
+        listener_flush(int(args))
+        return "0"
+    raise NotImplementedError(expr)
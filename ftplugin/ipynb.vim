@@ -6,6 +6,76 @@ if !has('pythonx')
     finish
 end
 
+" listener_add() callback keeping the cell index of the buffer up to date
+function! IpynbLinesChanged(bufnr, start, end, added, changes)
+    pythonx on_lines_changed()
+endfunction
+
+" timer reporting the progress of :ToHtml, :ToMd and :ToPdf
+function! IpynbExportPoll(timer)
+    pythonx export_poll()
+endfunction
+
+" timer handing the messages of cells running in the background to vim
+function! IpynbDrainKernels(timer)
+    pythonx drain_executors()
+endfunction
+
+if !exists("g:ipynb_background_execution")
+    let g:ipynb_background_execution=0
+endif
+
+if !exists("g:ipynb_shared_kernel")
+    let g:ipynb_shared_kernel=""
+endif
+
+if !exists("g:ipynb_kernel_pool_size")
+    let g:ipynb_kernel_pool_size=0
+endif
+
+if !exists("g:ipynb_kernel_pool_warmup")
+    let g:ipynb_kernel_pool_warmup=""
+endif
+
+if !exists("g:ipynb_time_imports")
+    let g:ipynb_time_imports=0
+endif
+
+if !exists("g:ipynb_trace_file")
+    let g:ipynb_trace_file=""
+endif
+
+if !exists("g:ipynb_trace_file_size")
+    let g:ipynb_trace_file_size=1048576
+endif
+
+if !exists("g:ipynb_lazy_outputs")
+    let g:ipynb_lazy_outputs=1
+endif
+
+if !exists("g:ipynb_output_spill_size")
+    let g:ipynb_output_spill_size=65536
+endif
+
+if !exists("g:ipynb_cell_output_limit")
+    let g:ipynb_cell_output_limit=4194304
+endif
+
+if !exists("g:ipynb_notebook_output_limit")
+    let g:ipynb_notebook_output_limit=67108864
+endif
+
+if !exists("g:ipynb_output_refresh_rate")
+    let g:ipynb_output_refresh_rate=10
+endif
+
+if !exists("g:ipynb_output_window_lines")
+    let g:ipynb_output_window_lines=10000
+endif
+
+if !exists("g:ipynb_render_cache_size")
+    let g:ipynb_render_cache_size=67108864
+endif
 
 
 pyx << EOF
@@ -16,8 +86,12 @@ vim_expand = vim.Function('expand')
 vim_jupyter_path = str(vim_expand('<sfile>:p:h'), 'utf-8') + "/python"
 
 sys.path.append(vim_jupyter_path)
-from vimjupytermanager import *
-launch(vim.current.buffer.name)
+from vimjupyterstartup import startup_phase, startup_done
+with startup_phase("import the plugin"):
+    from vimjupytermanager import *
+with startup_phase("open " + vim.current.buffer.name):
+    launch(vim.current.buffer.name)
+startup_done()
 
 currentLanguage = get_language(vim.current.buffer.name)
    
@@ -26,7 +100,8 @@ vim.command(ultisnapcmd)
 EOF
 
 
-au BufWritePost *.ipynb pythonx vim_jupyter_formatter[vim.current.buffer.name].to_ipynb()
+" the plugin writes the notebook itself, only when cells changed
+au BufWriteCmd *.ipynb pythonx write_notebook(vim.eval("expand('<afile>:p')"))
 au BufDelete *.ipynb pythonx clean_up(vim.current.buffer.name)
 au VimLeave * pythonx clean_all()
 
@@ -42,6 +117,7 @@ command! -nargs=0 ToMd                    :pythonx vim_jupyter_formatter[vim.cur
 command! -nargs=0 ToPdf                   :pythonx vim_jupyter_formatter[vim.current.buffer.name].to_pdf()
 command! -nargs=0 ToCode                  :pythonx vim_jupyter_formatter[vim.current.buffer.name].to_code()
 command! -nargs=0 ClearAll                :pythonx vim_jupyter_formatter[vim.current.buffer.name].clear_all_output()
+command! -nargs=0 OutputLog               :pythonx vim_jupyter_wrapper[vim.current.buffer.name].output_log()
 
 
 
@@ -50,7 +126,12 @@ command! -nargs=1 StartKernel             :pythonx start_kernel(vim.current.buff
 command! -nargs=1 ConnectToKernel         :pythonx change_kernel(vim.current.buffer.name, existing="<args>")
 command! -nargs=0 ConnectToPreviousKernel :pythonx change_kernel(vim.current.buffer.name, existing="kernel-*.json")
 command! -nargs=0 KernelShutdown          :pythonx vim_jupyter_wrapper[vim.current.buffer.name].shutdown_verbose()
-command! -nargs=0 KernelRestart           :pythonx vim_jupyter_wrapper[vim.current.buffer.name].restart()
+command! -nargs=0 KernelRestart           :pythonx restart_kernel(vim.current.buffer.name)
+command! -nargs=0 KernelInterrupt         :pythonx vim_jupyter_wrapper[vim.current.buffer.name].interrupt()
+command! -nargs=0 KernelStats             :pythonx vim_jupyter_wrapper[vim.current.buffer.name].kernel_stats()
+command! -nargs=0 KernelTraceSummary      :pythonx vim_jupyter_wrapper[vim.current.buffer.name].trace_summary()
+command! -nargs=0 ProfileCell             :pythonx vim_jupyter_wrapper[vim.current.buffer.name].profile_cell()
+command! -nargs=0 JupyterStartupProfile   :pythonx show_startup_profile()
 command! -nargs=0 RunAll                  :pythonx vim_jupyter_wrapper[vim.current.buffer.name].run_all()
 command! -nargs=0 RunLine                 :pythonx vim_jupyter_wrapper[vim.current.buffer.name].run_line()
 command! -nargs=0 RunLineAbort            :pythonx vim_jupyter_wrapper[vim.current.buffer.name].run_line_abort()
@@ -73,12 +154,17 @@ noremap  <Plug>(ToMd)                    :ToMd<CR>
 noremap  <Plug>(ToPdf)                   :ToPdf<CR>
 noremap  <Plug>(ToCode)                :ToCode<CR>
 noremap  <Plug>(ClearAll)                :ClearAll<CR>
+noremap  <Plug>(OutputLog)               :OutputLog<CR>
 
 noremap  <Plug>(ConnectToPreviousKernel) :ConnectToPreviousKernel<CR>
 noremap  <Plug>(ConnectToKernel)         :ConnectToKernel<Space>
 noremap  <Plug>(StartKernel)             :StartKernel<Space>
 noremap  <Plug>(KernelShutdown)          :KernelShutdown<CR>
 noremap  <Plug>(KernelRestart)           :KernelRestart<CR>
+noremap  <Plug>(KernelInterrupt)         :KernelInterrupt<CR>
+noremap  <Plug>(KernelStats)             :KernelStats<CR>
+noremap  <Plug>(KernelTraceSummary)      :KernelTraceSummary<CR>
+noremap  <Plug>(JupyterStartupProfile)   :JupyterStartupProfile<CR>
 
 noremap  <Plug>(RunCell)                 :RunCell<Space>
 noremap  <Plug>(RunCurrentCell)          :RunCurrentCell<CR>
@@ -86,6 +172,7 @@ noremap  <Plug>(RunCurrentCellDown)      :RunCurrentCellDown<CR>
 noremap  <Plug>(RunLine)                 :RunLine<CR>
 noremap  <Plug>(RunLineAbort)            :RunLineAbort<CR>
 noremap  <Plug>(RunAll)                  :RunAll<CR>
+noremap  <Plug>(ProfileCell)             :ProfileCell<CR>
 
 noremap  <Plug>(PrintUnderCursor)        :PrintUnderCursor<CR>
 noremap  <Plug>(PrintVariable)           :PrintVariable<Space>
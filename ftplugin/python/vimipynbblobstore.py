@@ -0,0 +1,105 @@
+""" Content addressed store for large cell outputs
+
+Output payloads above g:ipynb_output_spill_size are moved out of the
+python heap into files of the runtime directory. The cell keeps a small
+VimIpynbBlobRef, and the payload is copied back from a memory map when the
+notebook is written.
+"""
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import tempfile
+
+
+ref_prefix = "@vim-ipynb-ref:"
+
+
+class VimIpynbBlobRef(str):
+    """ Stands for a payload in the blob store. Serialized as a reference
+    token that VimIpynbFormatter.write_file replaces by the payload.
+    """
+
+    def __new__(cls, digest):
+        ref = str.__new__(cls, ref_prefix + "blob:" + digest + "@")
+        ref.digest = digest
+        return ref
+
+
+class VimIpynbBlobStore():
+    prefix = "vim-ipynb-blobs-"
+
+    def __init__(self, root=None):
+        if root is None:
+            from jupyter_core.paths import jupyter_runtime_dir
+            root = jupyter_runtime_dir()
+        # one directory per vim process, removed when vim leaves
+        self.path = os.path.join(root, self.prefix + str(os.getpid()))
+        self.remove_stale(root)
+
+    def blob_path(self, digest):
+        return os.path.join(self.path, digest)
+
+    def put(self, value):
+        """ Store value and return its VimIpynbBlobRef. The blob holds the
+        value already encoded as json.
+        """
+        data = json.dumps(value, ensure_ascii=False).encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.blob_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(self.path, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.path)
+            with os.fdopen(fd, "wb") as tmp_file:
+                tmp_file.write(data)
+            os.replace(tmp_path, path)
+        return VimIpynbBlobRef(digest)
+
+    def write(self, f, digest):
+        """ Copy the json encoded payload into the binary file f """
+        with open(self.blob_path(digest), "rb") as blob:
+            with mmap.mmap(blob.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                f.write(data)
+
+    def load(self, digest):
+        with open(self.blob_path(digest), "rb") as blob:
+            return json.loads(blob.read())
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def remove_stale(self, root):
+        """ Remove the directories left by vim processes that are gone """
+        try:
+            names = os.listdir(root)
+        except OSError:
+            return
+        for name in names:
+            if not name.startswith(self.prefix):
+                continue
+            try:
+                pid = int(name[len(self.prefix):])
+                os.kill(pid, 0)
+            except ValueError:
+                continue
+            except ProcessLookupError:
+                shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+            except OSError:
+                # the process exists but belongs to someone else
+                pass
+
+
+_blob_store = None
+
+
+def blob_store():
+    global _blob_store
+    if _blob_store is None:
+        _blob_store = VimIpynbBlobStore()
+    return _blob_store
+
+
+def clear_blob_store():
+    if _blob_store is not None:
+        _blob_store.clear()
@@ -0,0 +1,277 @@
+""" Incremental index of the cells in a formatted notebook buffer
+
+The index maps each cell name to its line range, type and source hash. It is
+kept up to date through Vim's listener_add() callbacks, so only the lines that
+changed since the last lookup are parsed again.
+"""
+import hashlib
+import re
+
+import vim
+
+
+# compiled cell markers, one set per kernel language
+_markers = {}
+
+
+def get_markers(language):
+    """ Return the (markdown, code_begin, code_end) patterns for a kernel
+    language. Patterns are compiled once and shared by every buffer.
+    """
+    markers = _markers.get(language)
+    if markers is None:
+        markers = (
+            re.compile(r'^#%%(?:(.*?)$|(.*?)\s(.*?)$)'),
+            re.compile(r'^```(?:' + re.escape(language) +
+                       r')\s(?:(.*?)$|(.*?)\s(.*?)$)'),
+            re.compile(r'^```\s*$'))
+        _markers[language] = markers
+    return markers
+
+
+# cell indexes with an active listener, keyed by buffer number
+cell_indexes = {}
+
+
+def on_lines_changed():
+    """ Called from the IpynbLinesChanged() listener in ftplugin/ipynb.vim """
+    index = cell_indexes.get(int(vim.eval("a:bufnr")))
+    if index is not None:
+        index.lines_changed(int(vim.eval("a:start")),
+                            int(vim.eval("a:end")),
+                            int(vim.eval("a:added")))
+
+
+class VimIpynbCellEntry():
+    """ One cell of the buffer. Rows are 0-based.
+
+    begin is the row of the cell marker, fence the row of the closing ``` of
+    a code cell (None if missing) and end the row of the next marker.
+    """
+    __slots__ = ('name', 'cell_type', 'begin', 'fence', 'end', 'source',
+                 'source_hash')
+
+    def __init__(self, name, cell_type, begin):
+        self.name = name
+        self.cell_type = cell_type
+        self.begin = begin
+        self.fence = None
+        self.end = begin + 1
+        self.source = ""
+        self.source_hash = ""
+
+    def set_source(self, source):
+        self.source = source
+        self.source_hash = hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+    def shift(self, added):
+        self.begin += added
+        self.end += added
+        if self.fence is not None:
+            self.fence += added
+
+
+class VimIpynbCellIndex():
+    # number of lines fetched from vim at once while scanning
+    chunk_size = 512
+
+    def __init__(self):
+        self.buffer = None
+        self.language = ""
+        self.entries = []
+        # changed rows [lo, hi) not parsed yet, None if the index is clean
+        self.dirty = None
+        self.listener_id = 0
+        self._by_name = None
+        self._begins = None
+
+    def attach(self, buffer):
+        self.buffer = buffer
+        self.invalidate()
+        if self.listener_id == 0 and int(vim.eval("exists('*listener_add')")):
+            self.listener_id = int(vim.eval(
+                "listener_add('IpynbLinesChanged', {0})".format(
+                    buffer.number)))
+            cell_indexes[buffer.number] = self
+
+    def detach(self):
+        if self.listener_id:
+            vim.eval("listener_remove({0})".format(self.listener_id))
+            self.listener_id = 0
+        if self.buffer is not None:
+            cell_indexes.pop(self.buffer.number, None)
+
+    def set_language(self, language):
+        if language != self.language:
+            self.language = language
+            self.invalidate()
+
+    def load(self, entries):
+        """ Take entries built along with the buffer lines, e.g. by
+        VimIpynbFormatter.to_buffer(), instead of parsing the buffer.
+        """
+        # the change that wrote the lines is already described by entries
+        self.flush()
+        self.entries = entries
+        self.dirty = None
+        self._changed()
+
+    def invalidate(self):
+        """ Drop every entry, the next lookup parses the whole buffer """
+        self.entries = []
+        self.dirty = (0, len(self.buffer) if self.buffer is not None else 0)
+        self._changed()
+
+    # lookups
+
+    def cells(self):
+        self.refresh()
+        return self.entries
+
+    def find(self, name):
+        self.refresh()
+        if self._by_name is None:
+            self._by_name = {}
+            for entry in self.entries:
+                self._by_name.setdefault(entry.name, entry)
+        return self._by_name.get(name)
+
+    def cell_at(self, row):
+        """ Return the cell containing the 0-based row, or None """
+        self.refresh()
+        if self._begins is None:
+            self._begins = [entry.begin for entry in self.entries]
+        lo, hi = 0, len(self._begins)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._begins[mid] <= row:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            return None
+        entry = self.entries[lo - 1]
+        if row < entry.end:
+            return entry
+        return None
+
+    # updates
+
+    def lines_changed(self, start, end, added):
+        """ Lines [start, end) (1-based) were replaced by end - start + added
+        lines. Shift the cells below the change and mark the rows as dirty.
+        """
+        s0, e0 = start - 1, end - 1
+        kept = []
+        for entry in self.entries:
+            if entry.begin >= e0:
+                entry.shift(added)
+            elif entry.begin >= s0:
+                # marker line was rewritten, parsed again on refresh
+                continue
+            kept.append(entry)
+        self.entries = kept
+
+        lo, hi = s0, e0 + added
+        if self.dirty is not None:
+            old_lo, old_hi = self.dirty
+            if old_hi >= e0:
+                old_hi += added
+            elif old_hi > s0:
+                old_hi = e0 + added
+            lo = min(lo, old_lo)
+            hi = max(hi, old_hi)
+        self.dirty = (lo, hi)
+        self._changed()
+
+    def flush(self):
+        """ Deliver pending listener callbacks """
+        if self.listener_id:
+            vim.eval("listener_flush({0})".format(self.buffer.number))
+
+    def refresh(self):
+        if self.buffer is None:
+            return
+        if self.listener_id:
+            self.flush()
+        else:
+            # no listener support, every lookup parses the whole buffer
+            self.invalidate()
+        if self.dirty is None:
+            return
+        lo, hi = self.dirty
+        self.dirty = None
+        self._rescan(lo, hi)
+        self._changed()
+
+    def _changed(self):
+        self._by_name = None
+        self._begins = None
+
+    def _lines(self, row):
+        nrow = len(self.buffer)
+        while row < nrow:
+            for line in self.buffer[row:row + self.chunk_size]:
+                yield row, line
+                row += 1
+
+    def _rescan(self, lo, hi):
+        """ Parse from the cell containing row lo until the parse lines up
+        with an untouched cell marker at or after row hi again.
+        """
+        entries = self.entries
+        i = len(entries)
+        while i > 0 and entries[i - 1].begin >= lo:
+            i -= 1
+        if i > 0:
+            i -= 1
+            start = entries[i].begin
+        else:
+            start = 0
+        j = i
+
+        markdown, code_begin, code_end = get_markers(self.language)
+        new_entries = []
+        current = None
+        lines = []
+        in_code = False
+        row = start
+        for row, line in self._lines(start):
+            if in_code:
+                if code_end.match(line):
+                    in_code = False
+                    current.fence = row
+                else:
+                    lines.append(line)
+                continue
+            cell_type = 'markdown'
+            match = markdown.match(line)
+            if match is None:
+                cell_type = 'code'
+                match = code_begin.match(line)
+            if match is None:
+                if current is not None:
+                    lines.append(line)
+                continue
+            if row >= hi:
+                while j < len(entries) and entries[j].begin < row:
+                    j += 1
+                if j < len(entries) and entries[j].begin == row:
+                    break
+            self._close(current, lines, row, new_entries)
+            current = VimIpynbCellEntry(match.group(1), cell_type, row)
+            lines = []
+            in_code = cell_type == 'code'
+        else:
+            row = len(self.buffer)
+            j = len(entries)
+        self._close(current, lines, row, new_entries)
+        entries[i:j] = new_entries
+
+    def _close(self, entry, lines, end, new_entries):
+        if entry is None:
+            return
+        entry.end = end
+        # the blank line in front of the next marker is not part of the cell
+        entry.set_source("".join(line + '\n' for line in lines)[:-2])
+        new_entries.append(entry)
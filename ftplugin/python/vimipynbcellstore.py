@@ -0,0 +1,134 @@
+""" Cells of one notebook, in notebook order and by name
+
+Each cell is a VimIpynbCellRecord instead of a NotebookNode. The source is
+the string taken from the cell index, outputs and metadata are kept by
+reference, and a NotebookNode is only built when the cell is serialized.
+"""
+import nbformat
+
+
+class VimIpynbCellRecord():
+    __slots__ = ("name", "cell_type", "source", "outputs", "execution_count",
+                 "metadata", "attachments", "id", "extra")
+
+    def __init__(self, cell_type, name=None, source=""):
+        self.name = name
+        self.cell_type = cell_type
+        self.source = source
+        self.outputs = [] if cell_type == "code" else None
+        self.execution_count = None
+        # None stands for an empty dict
+        self.metadata = None
+        self.attachments = None
+        self.id = None
+        # keys nbformat does not define, written back untouched
+        self.extra = None
+
+    @classmethod
+    def from_node(cls, node):
+        record = cls(node["cell_type"], source=node.get("source", ""))
+        for key, value in node.items():
+            if key in ("cell_type", "source"):
+                continue
+            if key == "metadata":
+                record.metadata = value or None
+            elif key in ("outputs", "execution_count", "attachments", "id"):
+                setattr(record, key, value)
+            else:
+                if record.extra is None:
+                    record.extra = {}
+                record.extra[key] = value
+        return record
+
+    def to_dict(self):
+        """ The cell as nbformat lays it out """
+        cell = {"cell_type": self.cell_type,
+                "metadata": self.metadata if self.metadata else {},
+                "source": self.source}
+        if self.cell_type == "code":
+            cell["outputs"] = self.outputs
+            cell["execution_count"] = self.execution_count
+        if self.attachments is not None:
+            cell["attachments"] = self.attachments
+        if self.id is not None:
+            cell["id"] = self.id
+        if self.extra:
+            cell.update(self.extra)
+        return cell
+
+    def to_node(self):
+        return nbformat.from_dict(self.to_dict())
+
+
+class VimIpynbCellStore():
+
+    def __init__(self):
+        self.records = []
+        # name -> position in records, updated from the first position the
+        # order changes at
+        self.positions = {}
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __contains__(self, name):
+        return name in self.positions
+
+    def __getitem__(self, name):
+        return self.records[self.positions[name]]
+
+    def get(self, name):
+        position = self.positions.get(name)
+        return None if position is None else self.records[position]
+
+    def load(self, nodes):
+        """ Replace the cells by records of the notebook cells nodes """
+        self.set_order([VimIpynbCellRecord.from_node(node) for node in nodes])
+        return self.records
+
+    def append(self, record):
+        if record.name is not None:
+            self.positions[record.name] = len(self.records)
+        self.records.append(record)
+
+    def insert(self, position, record):
+        """ Put record at position, the records after it move down one """
+        self.records.insert(position, record)
+        self.reposition(position, len(self.records))
+
+    def move(self, name, position):
+        """ Move the record of name to position """
+        old = self.positions[name]
+        self.records.insert(position, self.records.pop(old))
+        self.reposition(min(old, position), max(old, position) + 1)
+
+    def set_order(self, records):
+        """ Replace the records by records, the positions of those before
+        the first change are kept
+        """
+        records = list(records)
+        start = 0
+        end = min(len(records), len(self.records))
+        while start < end and records[start] is self.records[start]:
+            start += 1
+        for position in range(start, len(self.records)):
+            name = self.records[position].name
+            if self.positions.get(name) == position:
+                del self.positions[name]
+        self.records = records
+        self.reposition(start, len(records))
+
+    def reposition(self, start, end):
+        for position in range(start, end):
+            name = self.records[position].name
+            if name is not None:
+                self.positions[name] = position
+
+    def reindex(self):
+        """ Map names to positions again, after records were renamed """
+        self.positions = {record.name: n
+                          for n, record in enumerate(self.records)
+                          if record.name is not None}
@@ -0,0 +1,267 @@
+""" Background export of notebooks to html, markdown and pdf
+
+Exports run in a worker process that keeps the nbconvert exporters and their
+templates loaded between requests. Vim sends requests to the worker through
+its stdin and a timer picks up progress from its stdout, so editing goes on
+while a notebook is converted. Requests for a notebook and format already
+waiting in the queue are merged into one.
+
+Run as a script, this module is the worker.
+"""
+import json
+import os
+import subprocess
+import sys
+import threading
+
+try:
+    from queue import Queue, Empty  # Py 3
+except ImportError:
+    from Queue import Queue, Empty  # Py 2
+
+
+# -----------------------------------------------------------------------------
+# Worker process
+# -----------------------------------------------------------------------------
+
+def nbconvert_version():
+    import nbconvert
+    return int(nbconvert.__version__.split('.')[0])
+
+
+class VimIpynbExportWorker():
+    """ Runs inside the worker process, one export at a time """
+
+    def __init__(self):
+        self.exporters = {}
+        self.writer = None
+        self.queue = []
+        self.lock = threading.Condition()
+        self.closed = False
+
+    def get_exporter(self, fmt):
+        exporter = self.exporters.get(fmt)
+        if exporter is not None:
+            return exporter
+        from nbconvert.exporters import (HTMLExporter, MarkdownExporter,
+                                         PDFExporter)
+        from traitlets.config import Config
+        c = Config()
+        c.CSSHTMLHeaderPreprocessor.style = 'colorful'
+        c.LatexPreprocessor.style = 'colorful'
+        if fmt == "html":
+            exporter = HTMLExporter(config=c)
+            if nbconvert_version() < 6:
+                # the default template of nbconvert 6 and later
+                exporter.template_file = 'full'
+        elif fmt == "markdown":
+            exporter = MarkdownExporter()
+            from vimipynbrendercache import VimIpynbCellKeys
+            exporter.register_preprocessor(VimIpynbCellKeys, enabled=True)
+        elif fmt == "pdf":
+            exporter = PDFExporter(config=c)
+        else:
+            raise ValueError("Unknown export format " + fmt)
+        self.exporters[fmt] = exporter
+        return exporter
+
+    def export(self, request):
+        from nbconvert.writers import FilesWriter
+        if self.writer is None:
+            self.writer = FilesWriter()
+        exporter = self.get_exporter(request["format"])
+        if request["format"] in ("html", "markdown") and \
+                request.get("cache_size", 0) > 0:
+            from vimipynbrendercache import (VimIpynbRenderCache,
+                                             render_cached)
+            cache = VimIpynbRenderCache(request["path"],
+                                        request["cache_size"])
+            body, resources = render_cached(exporter, request["path"], cache)
+        else:
+            body, resources = exporter.from_filename(request["path"])
+        self.writer.build_directory = request["directory"]
+        notebook_name = os.path.basename(request["path"]).split('.')[0]
+        return self.writer.write(body, resources, notebook_name=notebook_name)
+
+    def read_requests(self, stdin):
+        for line in stdin:
+            request = json.loads(line)
+            key = (request["path"], request["format"])
+            with self.lock:
+                # a request still waiting covers this one
+                if key not in [(r["path"], r["format"]) for r in self.queue]:
+                    self.queue.append(request)
+                self.lock.notify()
+        with self.lock:
+            self.closed = True
+            self.lock.notify()
+
+    def reply(self, request, status, **kwargs):
+        kwargs.update(path=request["path"], format=request["format"],
+                      status=status)
+        sys.stdout.write(json.dumps(kwargs) + "\n")
+        sys.stdout.flush()
+
+    def run(self):
+        reader = threading.Thread(target=self.read_requests,
+                                  args=(sys.stdin,))
+        reader.daemon = True
+        reader.start()
+        while True:
+            with self.lock:
+                while not self.queue and not self.closed:
+                    self.lock.wait()
+                if not self.queue:
+                    return
+                request = self.queue.pop(0)
+            self.reply(request, "started")
+            try:
+                output = self.export(request)
+            except Exception as e:
+                self.reply(request, "error",
+                           error="{0}: {1}".format(type(e).__name__, e))
+            else:
+                self.reply(request, "done", output=str(output))
+
+
+# -----------------------------------------------------------------------------
+# Vim side
+# -----------------------------------------------------------------------------
+
+def python_executable():
+    """ The python running vim's python interface may be vim itself """
+    if os.path.basename(sys.executable).startswith("python"):
+        return sys.executable
+    if sys.platform == "win32":
+        return os.path.join(sys.exec_prefix, "python.exe")
+    return os.path.join(sys.exec_prefix, "bin",
+                        "python{0}".format(sys.version_info[0]))
+
+
+class VimIpynbExportClient():
+    """ Sends exports to the worker process and reports their progress """
+
+    poll_interval = 200
+
+    def __init__(self):
+        self.process = None
+        self.replies = Queue()
+        # (path, format) -> "queued" or "started"
+        self.pending = {}
+        self.timer = None
+
+    def start_worker(self):
+        if self.process is not None and self.process.poll() is None:
+            return
+        self.process = subprocess.Popen(
+            [python_executable(), os.path.abspath(__file__)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, universal_newlines=True)
+        reader = threading.Thread(target=self.read_replies,
+                                  args=(self.process.stdout,))
+        reader.daemon = True
+        reader.start()
+        self.pending.clear()
+
+    def read_replies(self, stdout):
+        for line in stdout:
+            self.replies.put(json.loads(line))
+
+    def export(self, path, fmt, directory, cache_size=0):
+        key = (path, fmt)
+        if self.pending.get(key) == "queued":
+            # the worker has not started the previous request yet
+            return
+        self.start_worker()
+        request = dict(path=path, format=fmt, directory=directory,
+                       cache_size=cache_size)
+        self.process.stdin.write(json.dumps(request) + "\n")
+        self.process.stdin.flush()
+        self.pending[key] = "queued"
+        self.echo("Exporting {0} to {1}".format(os.path.basename(path), fmt))
+        self.start_timer()
+
+    def start_timer(self):
+        import vim
+        if self.timer is not None:
+            return
+        if int(vim.eval("exists('*timer_start')")):
+            self.timer = int(vim.eval(
+                "timer_start({0}, 'IpynbExportPoll', {{'repeat': -1}})".format(
+                    self.poll_interval)))
+        else:
+            # no timers, wait for the export
+            while self.pending and self.process.poll() is None:
+                self.poll(timeout=0.5)
+
+    def stop_timer(self):
+        import vim
+        if self.timer is not None:
+            vim.eval("timer_stop({0})".format(self.timer))
+            self.timer = None
+
+    def poll(self, timeout=None):
+        """ Report the replies received so far, called by the timer """
+        while True:
+            try:
+                reply = self.replies.get(timeout=timeout)
+            except Empty:
+                break
+            timeout = None
+            key = (reply["path"], reply["format"])
+            name = os.path.basename(reply["path"])
+            if reply["status"] == "started":
+                self.pending[key] = "started"
+                continue
+            self.pending.pop(key, None)
+            if reply["status"] == "done":
+                self.echo("Exported {0}: {1}".format(name, reply["output"]))
+            else:
+                self.echo("Export of {0} to {1} failed: {2}".format(
+                    name, reply["format"], reply["error"]))
+        if self.process is not None and self.process.poll() is not None:
+            # the worker died, forget about its requests
+            self.pending.clear()
+        if not self.pending:
+            self.stop_timer()
+
+    def echo(self, msg):
+        import vim
+        vim.command("echomsg " + json.dumps(msg))
+
+    def shutdown(self):
+        self.stop_timer()
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            self.process.stdin.close()
+            try:
+                self.process.wait(timeout=1)
+            except subprocess.TimeoutExpired:
+                self.process.terminate()
+        self.process = None
+
+
+_export_client = None
+
+
+def export_client():
+    global _export_client
+    if _export_client is None:
+        _export_client = VimIpynbExportClient()
+    return _export_client
+
+
+def export_poll():
+    """ Called from the IpynbExportPoll() timer in ftplugin/ipynb.vim """
+    if _export_client is not None:
+        _export_client.poll()
+
+
+def shutdown_export_worker():
+    if _export_client is not None:
+        _export_client.shutdown()
+
+
+if __name__ == "__main__":
+    VimIpynbExportWorker().run()
@@ -1,45 +1,76 @@
 """ For extract info from and format .ipynb notebook
 
 """
-from collections import OrderedDict
 from nbformat.v4 import (
     nbformat as current_nbformat,
     nbformat_minor as current_nbformat_minor
 )
-from jupyter_client import kernelspec
+from nbformat.v4.nbbase import random_cell_id
+from nbformat.v4.nbjson import BytesEncoder
+from nbformat.v4.rwbase import split_lines
 import vim
 import nbformat
+import hashlib
+import json
+import os
 import re
+import stat
+import tempfile
+from datetime import datetime
 
-from nbconvert.exporters import (HTMLExporter, MarkdownExporter, PDFExporter,
-                                 PythonExporter)
+from vimipynbcellindex import (VimIpynbCellEntry, VimIpynbCellIndex,
+                               get_markers)
+from vimipynbcellstore import VimIpynbCellRecord, VimIpynbCellStore
+from vimipynboutputbudget import VimIpynbOutputBudget
+from vimipynbreader import read_notebook
+from vimipynbblobstore import VimIpynbBlobRef, blob_store, ref_prefix
+from vimjupyterkernelspecs import kernel_specs
+from vimipynbexporter import export_client
 
-from nbconvert.writers import FilesWriter
-from traitlets.config import Config
+
+def seconds_between(start, end):
+    if not isinstance(start, datetime) or not isinstance(end, datetime):
+        return None
+    return (end - start).total_seconds()
 
 
 class VimIpynbFormatter():
-    buffer_formatted = False
-    vim_ipynb_nb = None
-    vim_ipynb_cells = OrderedDict()
-    # each formatter is in charge of one buffer
-    nb_buffer = None
-    kernel_info = {}
-    shell = None
-    kernel_language = ""
-    kernel_specs = {}
-    writer = FilesWriter()
-    c = Config()
-    c.CSSHTMLHeaderPreprocessor.style = 'colorful'
-    c.LatexPreprocessor.style = 'colorful'
+    # same layout as nbformat.write
+    json_kwargs = dict(cls=BytesEncoder, indent=1, sort_keys=True,
+                       separators=(",", ": "), ensure_ascii=False)
+    cells_token = "@vim-ipynb-cells@"
+    # payloads kept out of memory, copied into the file by write_file
+    ref_pattern = re.compile(
+        '"' + re.escape(ref_prefix) + r'(blob|lazy):(\w+)@"')
+    # mime types nbformat writes as lists of lines, never spilled
+    split_mimes = ("application/javascript", "image/svg+xml")
 
 
     def __init__(self):
-        pass
+        self.buffer_formatted = False
+        # metadata of the notebook, its cells are in vim_ipynb_cells
+        self.vim_ipynb_nb = None
+        self.vim_ipynb_cells = VimIpynbCellStore()
+        # each formatter is in charge of one buffer
+        self.nb_buffer = None
+        self.shell = None
+        self.kernel_language = ""
+        # kernel the notebook was saved with, from its metadata
+        self.kernel_name = ""
+        self.cell_index = VimIpynbCellIndex()
+        # id(cell) -> (cell, source hash, serialized cell) of the last write,
+        # serialized cell None for cells unchanged since the file was read
+        self.saved_cells = {}
+        self.saved_skeleton = None
+        self.saved_order = []
+        # ids of cells whose outputs changed since the last write
+        self.touched_cells = set()
+        # outputs still undecoded in the file, see read_ipynb
+        self.lazy_outputs = None
+        self.output_budget = VimIpynbOutputBudget()
 
     def assign_shell(self, shell):
         self.shell = shell
-        self._get_kernel_specs()
         self.update_from_buffer()
 
     def write_buffer(self):
@@ -47,10 +78,137 @@ class VimIpynbFormatter():
 
     # format methods
 
-    def to_ipynb(self):
+    def to_ipynb(self, path=None):
+        """ Write the notebook to path, the file of the buffer by default,
+        called on BufWriteCmd.
+
+        When writing to the file of the buffer, only cells whose source or
+        outputs changed since the last write are serialized again, the
+        others are reused from the last write. Nothing is written if no cell
+        changed since then, or since the file was read.
+        """
+        if path is None:
+            path = self.nb_buffer.name
+        own_file = os.path.abspath(path) == \
+            os.path.abspath(self.nb_buffer.name)
         self.update_from_buffer()
-        with open(self.nb_buffer.name, "w") as cf:
-            nbformat.write(self.vim_ipynb_nb, cf)
+        if not self.buffer_formatted:
+            # the raw json is edited, save it as it is
+            self.write_file(path, "\n".join(self.nb_buffer[:]) + "\n")
+            if own_file:
+                self.nb_buffer.options["modified"] = False
+            return
+
+        self.output_budget.flush()
+        if not own_file:
+            # :w other.ipynb, the state of the last write stays the one of
+            # the file of the buffer
+            self.write_file(path, self.serialize_notebook(
+                [self.serialize_cell(cell) for cell in self.vim_ipynb_cells],
+                self.serialize_skeleton()))
+            return
+
+        changed = len(self.saved_cells) != len(self.vim_ipynb_cells)
+        saved_cells = {}
+        fragments = []
+        for cell in self.vim_ipynb_cells:
+            entry = self.cell_index.find(cell.name) \
+                if cell.name is not None else None
+            source_hash = entry.source_hash if entry is not None else None
+            saved = self.saved_cells.get(id(cell))
+            if saved is None or saved[0] is not cell or \
+                    source_hash is None or saved[1] != source_hash or \
+                    id(cell) in self.touched_cells:
+                fragment = self.serialize_cell(cell)
+                changed = changed or saved is None or saved[2] != fragment
+            else:
+                fragment = saved[2]
+            saved_cells[id(cell)] = (cell, source_hash, fragment)
+            fragments.append(fragment)
+        self.touched_cells.clear()
+
+        skeleton = self.serialize_skeleton()
+        order = [id(cell) for cell in self.vim_ipynb_cells]
+        if not changed and skeleton == self.saved_skeleton and \
+                order == self.saved_order and os.path.exists(path):
+            self.nb_buffer.options["modified"] = False
+            return
+
+        for position, cell in enumerate(self.vim_ipynb_cells):
+            if fragments[position] is None:
+                # unchanged since the file was read
+                fragments[position] = self.serialize_cell(cell)
+                saved_cells[id(cell)] = (cell, saved_cells[id(cell)][1],
+                                         fragments[position])
+        self.write_file(path, self.serialize_notebook(fragments, skeleton))
+        self.saved_cells = saved_cells
+        self.saved_skeleton = skeleton
+        self.saved_order = order
+        self.nb_buffer.options["modified"] = False
+
+    def serialize_notebook(self, fragments, skeleton):
+        """ The text of the notebook from its serialized cells and skeleton
+        """
+        if fragments:
+            cells = "[\n" + ",\n".join(fragments) + "\n ]"
+        else:
+            cells = "[]"
+        return skeleton.replace(json.dumps(self.cells_token), cells, 1) + "\n"
+
+    def serialize_cell(self, cell):
+        """ Serialize one cell the way nbformat.write lays it out inside the
+        "cells" list.
+        """
+        lazy = self.lazy_outputs is not None and cell in self.lazy_outputs
+        node = nbformat.from_dict({"cells": [cell.to_dict()]})
+        split_lines(node)
+        node_cell = node.cells[0]
+        node_cell.get("metadata", {}).pop("trusted", None)
+        if lazy:
+            # copied from the notebook file by write_file
+            node_cell["outputs"] = ref_prefix + "lazy:" + str(id(cell)) + "@"
+        text = json.dumps(node_cell, **self.json_kwargs)
+        return "  " + text.replace("\n", "\n  ")
+
+    def serialize_skeleton(self):
+        """ Serialize everything except the cells, which are replaced by
+        cells_token.
+        """
+        node = nbformat.from_dict(
+            {key: value for (key, value) in self.vim_ipynb_nb.items()
+             if key != "cells"})
+        for key in ("orig_nbformat", "orig_nbformat_minor", "signature"):
+            node.get("metadata", {}).pop(key, None)
+        node["cells"] = self.cells_token
+        return json.dumps(node, **self.json_kwargs)
+
+    def write_file(self, path, text):
+        """ Write text to path through a temporary file and a rename.
+        Output references in text are replaced by their payloads.
+        """
+        try:
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+        except FileNotFoundError:
+            mode = 0o644
+        fd, tmp_path = tempfile.mkstemp(
+            prefix="." + os.path.basename(path) + ".",
+            dir=os.path.dirname(os.path.abspath(path)))
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                pos = 0
+                for match in self.ref_pattern.finditer(text):
+                    tmp_file.write(text[pos:match.start()].encode("utf-8"))
+                    if match.group(1) == "lazy":
+                        self.lazy_outputs.write(tmp_file, int(match.group(2)))
+                    else:
+                        blob_store().write(tmp_file, match.group(2))
+                    pos = match.end()
+                tmp_file.write(text[pos:].encode("utf-8"))
+            os.chmod(tmp_path, mode)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
 
     def to_pandoc(self):
         cb_name = self.nb_buffer.name.split('/')[-1]
@@ -64,32 +222,23 @@ class VimIpynbFormatter():
                     else:
                         mf.write(line + '\n')
 
-    def to_markdown(self):
-        cb_name = self.nb_buffer.name.split('/')[-1]
-        notebook_name = cb_name.split('.')[0]
+    def export(self, fmt):
+        """ Save the notebook and convert it in the background, the result
+        goes to the current directory.
+        """
         self.write_buffer()
-        markdown_exporter = MarkdownExporter()
-        body, resources = markdown_exporter.from_filename(cb_name)
-        self.writer.write(body, resources, notebook_name = notebook_name)
+        export_client().export(
+            os.path.abspath(self.nb_buffer.name), fmt, os.getcwd(),
+            int(vim.vars.get("ipynb_render_cache_size", 0)))
 
+    def to_markdown(self):
+        self.export("markdown")
 
     def to_html(self):
-        cb_name = self.nb_buffer.name.split('/')[-1]
-        notebook_name = cb_name.split('.')[0]
-        self.write_buffer()
-        html_exporter = HTMLExporter(config=self.c)
-        html_exporter.template_file = 'full'
-        body, resources = html_exporter.from_filename(cb_name)
-        self.writer.write(body, resources, notebook_name = notebook_name)
-
+        self.export("html")
 
     def to_pdf(self):
-        cb_name = self.nb_buffer.name.split('/')[-1]
-        notebook_name = cb_name.split('.')[0]
-        self.write_buffer()
-        pdf_exporter = PDFExporter(config=self.c)
-        body, resources = pdf_exporter.from_filename(cb_name)
-        self.writer.write(body, resources, notebook_name = notebook_name)
+        self.export("pdf")
 
     def to_code(self):
         if self.kernel_language == 'python':
@@ -103,9 +252,9 @@ class VimIpynbFormatter():
         script_name = cb_name.split('.')[0] + suffix
         self.write_buffer()
         with open(script_name, "w") as sf:
-            for name in self.vim_ipynb_cells:
-                if self.vim_ipynb_cells[name]['cell_type'] == "code":
-                    sf.write(self.vim_ipynb_cells[name]['source'])
+            for cell in self.vim_ipynb_cells:
+                if cell.cell_type == "code":
+                    sf.write(cell.source)
                     sf.write('\n\n')
 
 
@@ -118,81 +267,225 @@ class VimIpynbFormatter():
             return
         if name not in self.vim_ipynb_cells:
             self.update_from_buffer()
-        output = nbformat.v4.output_from_msg(msg)
-        self.vim_ipynb_cells[name]['outputs'].append(output)
+        if msg["header"]["msg_type"] == "stream":
+            # output_from_msg validates each output, too slow for streams
+            output = nbformat.NotebookNode(output_type="stream",
+                                           name=msg["content"]["name"],
+                                           text=msg["content"]["text"])
+        else:
+            output = nbformat.v4.output_from_msg(msg)
+        cell = self.vim_ipynb_cells[name]
+        self.load_outputs(cell)
+        # streams are merged, outputs over the limits dropped
+        output = self.output_budget.add(
+            cell, output, vim.vars.get("ipynb_cell_output_limit", 0),
+            vim.vars.get("ipynb_notebook_output_limit", 0))
+        if output is not None:
+            self.spill_output(output)
+        self.touched_cells.add(id(cell))
 
     def clear_all_output(self):
-        for name in self.vim_ipynb_cells:
-            if self.vim_ipynb_cells[name]['cell_type'] == "code":
-                self.vim_ipynb_cells[name]['outputs'] = []
+        self.output_budget.clear_all()
+        for cell in self.vim_ipynb_cells:
+            if cell.cell_type == "code":
+                cell.outputs = []
+                self.touched_cells.add(id(cell))
+                self.discard_outputs(cell)
 
     def clear_output(self, name):
         if name == '':
             return
         if name not in self.vim_ipynb_cells:
             self.update_from_buffer()
-        self.vim_ipynb_cells[name]['outputs'] = []
+        cell = self.vim_ipynb_cells[name]
+        cell.outputs = []
+        self.output_budget.clear(cell)
+        self.touched_cells.add(id(cell))
+        self.discard_outputs(cell)
+
+    def set_execution(self, name, execution, output_size):
+        """ Keep the timing of the last run of cell name in its metadata.
+        nbformat only allows timestamps in metadata.execution, the size of
+        the outputs goes in metadata["vim-ipynb"].
+        """
+        cell = self.vim_ipynb_cells.get(name)
+        if cell is None:
+            return
+        metadata = dict(cell.metadata) if cell.metadata else {}
+        metadata["execution"] = execution
+        metadata["vim-ipynb"] = dict(metadata.get("vim-ipynb") or {},
+                                     output_size=output_size)
+        cell.metadata = metadata
+        self.touched_cells.add(id(cell))
+
+    def execution_times(self):
+        """ Return (name, kernel seconds, seconds until the output was
+        shown, output size) for the cells with execution metadata
+        """
+        from jupyter_client.jsonutil import parse_date
+        times = []
+        for cell in self.vim_ipynb_cells:
+            execution = (cell.metadata or {}).get("execution")
+            if not execution:
+                continue
+            dates = {key: parse_date(value)
+                     for key, value in execution.items()
+                     if isinstance(value, str)}
+            kernel = seconds_between(
+                dates.get("shell.execute_reply.started",
+                          dates.get("iopub.status.busy")),
+                dates.get("shell.execute_reply"))
+            if kernel is None:
+                continue
+            total = seconds_between(dates.get("vim-ipynb.submitted"),
+                                    dates.get("vim-ipynb.done"))
+            times.append((cell.name, kernel, total,
+                          cell.metadata.get("vim-ipynb", {}).get(
+                              "output_size")))
+        return times
+
+    def load_outputs(self, cell):
+        """ Decode the outputs of cell if they were left in the file """
+        if self.lazy_outputs is not None and cell in self.lazy_outputs:
+            cell.outputs = self.lazy_outputs.load(cell)
+            for output in cell.outputs:
+                self.spill_output(output)
+
+    def spill_output(self, output):
+        """ Move payloads larger than g:ipynb_output_spill_size to the blob
+        store, leaving a VimIpynbBlobRef in output.
+        """
+        spill_size = vim.vars.get("ipynb_output_spill_size", 65536)
+        if spill_size <= 0:
+            return
+        data = output.get("data", {})
+        for mime, value in data.items():
+            if isinstance(value, str) and len(value) >= spill_size and \
+                    not isinstance(value, VimIpynbBlobRef) and \
+                    not mime.startswith("text/") and \
+                    mime not in self.split_mimes:
+                data[mime] = blob_store().put(value)
+
+    def discard_outputs(self, cell):
+        if self.lazy_outputs is not None:
+            self.lazy_outputs.discard(cell)
 
     # update methods
 
     def to_buffer(self):
+        """ Render the notebook into the buffer with a single assignment. The
+        cell index is built from the same pass, so no parse is needed.
+        """
         self.buffer_formatted = True
-        self.nb_buffer[:] = None
-        last_row = 0
+        self.cell_index.set_language(self.kernel_language)
+        self.cell_index.flush()
+        lines = []
+        entries = []
+        # a source line looking like a cell marker makes the index unreliable
+        marker_like = False
         n_code = 0
         n_mkd = 0
-        for n in range(len(self.vim_ipynb_nb.cells)):
-            cell = self.vim_ipynb_nb.cells[n]
-            if cell["cell_type"] == "code":
+        for cell in self.vim_ipynb_cells:
+            if cell.cell_type == "code":
                 n_code += 1
                 name = "code" + str(n_code)
-                last_row = self.buffer_append(
-                    last_row, "\n```"+self.kernel_language+' '+name)
-                last_row = self.buffer_append(
-                    last_row, cell["source"] + "\n```")
-
-            elif cell["cell_type"] == "markdown":
+                marker = "```" + self.kernel_language + ' ' + name
+            elif cell.cell_type == "markdown":
                 n_mkd += 1
                 name = "markdown" + str(n_mkd)
-                last_row = self.buffer_append(
-                    last_row, "\n#%%" + name)
-                last_row = self.buffer_append(
-                    last_row, cell["source"])
-
-            self.vim_ipynb_cells[name] = self.vim_ipynb_nb.cells[n]
-
+                marker = "#%%" + name
+            else:
+                continue
+
+            source = cell.source.split("\n")
+            lines.append("")
+            entry = VimIpynbCellEntry(name, cell.cell_type, len(lines))
+            lines.append(marker)
+            lines.extend(source)
+            if cell.cell_type == "code":
+                entry.fence = len(lines)
+                lines.append("```")
+            # the next marker follows the blank line
+            entry.end = len(lines) + 1
+            entry.set_source(cell.source)
+            entries.append(entry)
+            if not marker_like:
+                marker_like = any(line.startswith(("#%%", "```"))
+                                  for line in source)
+
+            cell.name = name
+        lines.append("")
+        self.vim_ipynb_cells.reindex()
+
+        self.nb_buffer[:] = lines
+        if marker_like:
+            self.cell_index.invalidate()
+        else:
+            self.cell_index.load(entries)
 
     def read_ipynb(self):
         # open .ipynb file
         self.nb_buffer = vim.current.buffer
+        self.cell_index.attach(self.nb_buffer)
         cb_name = self.nb_buffer.name
         try:
             with open(cb_name) as cf:
                 try:
-                    self.vim_ipynb_nb = nbformat.read(
-                        cf, as_version=current_nbformat)
+                    self.vim_ipynb_nb = None
+                    if vim.vars.get("ipynb_lazy_outputs", 1):
+                        try:
+                            self.vim_ipynb_nb, self.lazy_outputs = \
+                                read_notebook(cb_name)
+                        except ValueError:
+                            # not streamable, let nbformat deal with it
+                            pass
+                    if self.vim_ipynb_nb is None:
+                        self.vim_ipynb_nb = nbformat.read(
+                            cf, as_version=current_nbformat)
                     try:
                         self.kernel_language = self.vim_ipynb_nb[
                             "metadata"]["language_info"]["name"]
                     except:
                         # language_info is missing, set to default
                         self.kernel_language = "python"
-                    self._get_kernel_specs()
+                    self.cell_index.set_language(self.kernel_language)
+                    self.kernel_name = self.vim_ipynb_nb["metadata"].get(
+                        "kernelspec", {}).get("name", "")
                 except nbformat.reader.NotJSONError:
                     raise
                 finally:
                     pass
         except FileNotFoundError:
             self.vim_ipynb_nb = nbformat.v4.new_notebook()
+        self.load_cells()
+
+    def load_cells(self):
+        """ Move the cells of vim_ipynb_nb into vim_ipynb_cells """
+        nodes = self.vim_ipynb_nb.cells
+        records = self.vim_ipynb_cells.load(nodes)
+        if self.lazy_outputs is not None:
+            for node, record in zip(nodes, records):
+                self.lazy_outputs.move(node, record)
+        self.vim_ipynb_nb.cells = []
+        # the notebook is saved as nbformat 4.5, which requires cell ids.
+        # Cells of older notebooks get one here, their file is rewritten on
+        # the first save as its nbformat_minor changes.
+        for record in records:
+            if record.id is None:
+                record.id = random_cell_id()
+        # the file holds these cells, saving them unchanged writes nothing
+        self.saved_cells = {
+            id(record): (record, hashlib.sha1(
+                record.source.encode("utf-8")).hexdigest(), None)
+            for record in records}
+        self.saved_skeleton = self.serialize_skeleton()
+        self.saved_order = [id(record) for record in records]
 
     def update_from_buffer(self):
         if self.shell is not None:
             self.update_notebook_info()
             if self.buffer_formatted:
                 self.cells_from_buffer()
-                self.vim_ipynb_nb.cells = []
-                for cell in self.vim_ipynb_cells:
-                    self.vim_ipynb_nb.cells.append(self.vim_ipynb_cells[cell])
         else:
             vim.command("echo \"No running kernel. Please start one using :StartKernel(<kernel_name>)\" ")
 
@@ -203,60 +496,23 @@ class VimIpynbFormatter():
     def cells_from_buffer(self):
         if not self.buffer_formatted:
             return
-        in_code = False
-        new_cells = OrderedDict()
-        name = None
-        nrow = len(self.nb_buffer)
-
-        for l in range(nrow):
-            if not in_code:
-                matchObj = self.match_marker(self.nb_buffer[l], kind='markdown')
-                if matchObj:
-                    self.trim_n(name, new_cells)
-                    name = matchObj.group(1)
-                    try:
-                        if self.check_name(name, new_cells):
-                            if name in self.vim_ipynb_cells:
-                                new_cells[name] = \
-                                        self.vim_ipynb_cells[name]
-                                new_cells[name]["source"] = ""
-                            else:
-                                new_cells[name] =\
-                                        nbformat.v4.new_markdown_cell()
-                                new_cells[name]["source"] = ""
-                    except ValueError:
-                        raise
-                else:
-                    matchObj = self.match_marker(self.nb_buffer[l], kind='code_begin')
-                    if matchObj:
-                        self.trim_n(name, new_cells)
-                        in_code = True
-                        name = matchObj.group(1)
-                        try:
-                            if self.check_name(name, new_cells):
-                                if name in self.vim_ipynb_cells:
-                                    new_cells[name] = \
-                                        self.vim_ipynb_cells[name]
-                                    new_cells[name]["source"] = ""
-                                else:
-                                    new_cells[name] = \
-                                            nbformat.v4.new_code_cell()
-                                    new_cells[name]["source"] = ""
-
-                        except ValueError:
-                            raise
-                    else:
-                        if name is not None:
-                            new_cells[name]["source"] += (
-                                    self.nb_buffer[l] + '\n')
-            elif in_code:
-                matchObj = self.match_marker(self.nb_buffer[l], kind='code_end')
-                if matchObj:
-                    in_code = False
-                else:
-                    new_cells[name]["source"] += (self.nb_buffer[l] + '\n')
-        self.trim_n(name, new_cells)
-        self.vim_ipynb_cells = new_cells
+        names = set()
+        cells = []
+        for entry in self.cell_index.cells():
+            name = entry.name
+            if not self.check_name(name, names):
+                continue
+            names.add(name)
+            cell = self.vim_ipynb_cells.get(name)
+            if cell is None:
+                cell = VimIpynbCellRecord(entry.cell_type, name)
+                # nbformat 4.5 requires an id on every cell
+                if (self.vim_ipynb_nb.nbformat,
+                        self.vim_ipynb_nb.nbformat_minor) >= (4, 5):
+                    cell.id = random_cell_id()
+            cell.source = entry.source
+            cells.append(cell)
+        self.vim_ipynb_cells.set_order(cells)
 
     # utility methods
 
@@ -265,11 +521,8 @@ class VimIpynbFormatter():
     kind = "markdown", "code_begin", or "code_end"
     """
     def match_marker(self, line, kind):
-        markdown_cell_pattern = re.compile(r'^#%%(?:(.*?)$|(.*?)\s(.*?)$)')
-        code_cell_begin_pattern = \
-            re.compile(r'^```(?:' + self.kernel_language +
-                       ')\s(?:(.*?)$|(.*?)\s(.*?)$)')
-        code_cell_stop_pattern = re.compile(r'^```\s*$')
+        markdown_cell_pattern, code_cell_begin_pattern, \
+            code_cell_stop_pattern = get_markers(self.kernel_language)
         if kind == 'markdown':
             return markdown_cell_pattern.match(line)
         elif kind == 'code_begin':
@@ -281,12 +534,6 @@ class VimIpynbFormatter():
 
 
 
-    def trim_n(self, name, cells):
-        if name is not None:
-            # trim the last "\n" appended in from_ipynb
-            cells[name]["source"] = \
-                    cells[name]["source"][:-2]
-
     def check_name(self, name, cells):
         if name in cells:
             raise ValueError("Cell name already exists.")
@@ -301,19 +548,15 @@ class VimIpynbFormatter():
                             one letter: {0}".format(name))
         return False
 
-    def buffer_append(self, last_row, msg=""):
-        msg_list = msg.split("\n")
-        self.nb_buffer.append(msg_list, last_row)
-        return last_row + len(msg_list)
-
     def get_language(self):
         return self.kernel_language
 
     def get_kernel_name(self):
         if self.kernel_language:
-            return self.kernel_specs[self.kernel_language]["name"]
-        else:
-            return ""
+            spec = kernel_specs.get(self.kernel_name, self.kernel_language)
+            if spec is not None:
+                return spec["name"]
+        return ""
 
 
     def update_notebook_info(self):
@@ -324,22 +567,9 @@ class VimIpynbFormatter():
                 self.shell.kernel_info["language_info"]
             self.kernel_language = \
                 self.shell.kernel_info["language_info"]["name"]
-            self.vim_ipynb_nb.metadata["kernelspec"] = \
-                self.kernel_specs[self.kernel_language]
-
-    """
-    Get all kernel specs installed
-    """
-    def _get_kernel_specs(self):
-        kernelspec_manager = kernelspec.KernelSpecManager()
-        kernelspec_info = kernelspec_manager.get_all_specs()
-        for (key, value) in kernelspec_info.items():
-            self.kernel_specs[value["spec"]["language"]] = {"display_name":"", \
-                    "language":"", "name":""}
-            self.kernel_specs[value["spec"]["language"]]["display_name"] = \
-                value["spec"]["display_name"]
-            self.kernel_specs[value["spec"]["language"]]["language"] = \
-                value["spec"]["language"]
-            self.kernel_specs[value["spec"]["language"]]["name"] = \
-                key
-
+            self.cell_index.set_language(self.kernel_language)
+            if self.shell.manager is not None:
+                self.kernel_name = self.shell.manager.kernel_name
+            spec = kernel_specs.get(self.kernel_name, self.kernel_language)
+            if spec is not None:
+                self.vim_ipynb_nb.metadata["kernelspec"] = spec
@@ -0,0 +1,183 @@
+""" Merging of stream outputs and limits on the size of cell outputs
+
+Consecutive stream messages of a cell with the same name go to one output,
+like JupyterLab does. Outputs produced since the notebook was opened are
+limited to g:ipynb_cell_output_limit characters per cell and
+g:ipynb_notebook_output_limit per notebook. Past the limit, a stream keeps
+its first and last parts around a truncation marker, and other outputs are
+replaced by a marker counting what was dropped.
+"""
+from collections import deque
+
+import nbformat
+
+
+def output_size(output):
+    """ Number of characters an output takes, roughly as saved """
+    output_type = output.get("output_type")
+    if output_type == "stream":
+        return len(output.get("text", ""))
+    if output_type == "error":
+        return sum(len(line) for line in output.get("traceback", []))
+    size = 0
+    for value in output.get("data", {}).values():
+        size += len(value) if isinstance(value, str) else len(str(value))
+    return size
+
+
+class VimIpynbStreamOutput():
+    """ A stream output growing by appends. Above limit, only the first and
+    the last limit / 2 characters are kept. A limit of None keeps all.
+    """
+    __slots__ = ("output", "limit", "head", "head_size", "tail", "tail_size",
+                 "dropped")
+
+    def __init__(self, output, limit):
+        self.output = output
+        self.limit = limit
+        self.head = []
+        self.head_size = 0
+        self.tail = deque()
+        self.tail_size = 0
+        self.dropped = 0
+        self.append(output["text"])
+
+    @property
+    def size(self):
+        return self.head_size + self.tail_size
+
+    def append(self, text):
+        if self.limit is None or \
+                self.head_size + len(text) <= self.limit // 2 or \
+                (not self.dropped and not self.tail and
+                 self.head_size + len(text) <= self.limit):
+            self.head.append(text)
+            self.head_size += len(text)
+            return
+        if not self.dropped and not self.tail:
+            # the head is full, what is over half the limit starts the tail
+            text = "".join(self.head) + text
+            half = self.limit // 2
+            self.head = [text[:half]]
+            self.head_size = half
+            text = text[half:]
+        self.tail.append(text)
+        self.tail_size += len(text)
+        keep = self.limit - self.head_size
+        while self.tail_size > keep:
+            excess = self.tail_size - keep
+            first = self.tail[0]
+            if len(first) <= excess:
+                self.tail.popleft()
+                self.tail_size -= len(first)
+                self.dropped += len(first)
+            else:
+                self.tail[0] = first[excess:]
+                self.tail_size -= excess
+                self.dropped += excess
+
+    def materialize(self):
+        """ Set the text of the output from the parts kept """
+        text = "".join(self.head)
+        if not self.tail and not self.dropped:
+            # join the small appends once
+            self.head = [text]
+        if self.dropped:
+            text += ("\n[... {0} characters truncated by vim-ipynb ...]\n"
+                     .format(self.dropped))
+        text += "".join(self.tail)
+        self.output["text"] = text
+
+
+class VimIpynbOutputBudget():
+    """ Output sizes of the cells of one notebook, by id(cell) """
+
+    def __init__(self):
+        self.sizes = {}
+        self.total = 0
+        # stream output still growing, by cell
+        self.streams = {}
+        # marker output and the number and size of outputs dropped, by cell
+        self.dropped = {}
+
+    def add(self, cell, output, cell_limit, notebook_limit):
+        """ Add output to cell.outputs. Return the output appended to
+        cell.outputs, or None if output was merged or dropped.
+        """
+        key = id(cell)
+        used = self.sizes.get(key, 0)
+        cell_room = cell_limit - used if cell_limit > 0 else None
+        notebook_room = notebook_limit - self.total \
+            if notebook_limit > 0 else None
+        room = min([r for r in (cell_room, notebook_room) if r is not None],
+                   default=None)
+
+        stream = self.streams.get(key)
+        if output["output_type"] == "stream":
+            if stream is not None and cell.outputs and \
+                    cell.outputs[-1] is stream.output and \
+                    stream.output["name"] == output["name"]:
+                before = stream.size
+                stream.append(output["text"])
+                self.resize(key, stream.size - before)
+                return None
+            self.finish(key)
+            if room is not None and room <= 0:
+                self.drop(cell, output)
+                return None
+            stream = VimIpynbStreamOutput(output, room)
+            self.streams[key] = stream
+            cell.outputs.append(output)
+            self.resize(key, stream.size)
+            return output
+
+        self.finish(key)
+        size = output_size(output)
+        if room is not None and size > room:
+            self.drop(cell, output, size)
+            return None
+        cell.outputs.append(output)
+        self.resize(key, size)
+        return output
+
+    def resize(self, key, delta):
+        self.sizes[key] = self.sizes.get(key, 0) + delta
+        self.total += delta
+
+    def drop(self, cell, output, size=None):
+        """ Count output in the marker at the end of cell.outputs """
+        if size is None:
+            size = output_size(output)
+        key = id(cell)
+        marker, count, dropped_size = self.dropped.get(key, (None, 0, 0))
+        if marker is None or not cell.outputs or \
+                cell.outputs[-1] is not marker:
+            marker = nbformat.v4.new_output("stream", name="stderr", text="")
+            cell.outputs.append(marker)
+            count, dropped_size = 0, 0
+        count += 1
+        dropped_size += size
+        marker["text"] = ("[vim-ipynb: {0} output(s) of {1} characters "
+                          "dropped, over the output limit]\n").format(
+                              count, dropped_size)
+        self.dropped[key] = (marker, count, dropped_size)
+
+    def finish(self, key):
+        """ The stream of cell key stops growing """
+        stream = self.streams.pop(key, None)
+        if stream is not None:
+            stream.materialize()
+
+    def flush(self):
+        """ Bring the text of growing streams up to date, before a save """
+        for stream in self.streams.values():
+            stream.materialize()
+
+    def clear(self, cell):
+        key = id(cell)
+        self.streams.pop(key, None)
+        self.dropped.pop(key, None)
+        self.total -= self.sizes.pop(key, 0)
+
+    def clear_all(self):
+        self.__init__()
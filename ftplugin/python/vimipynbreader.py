@@ -0,0 +1,225 @@
+""" Streaming reader for .ipynb files with lazily decoded outputs
+
+Cell sources and metadata are decoded right away. The outputs of each code
+cell stay as a byte range of the memory mapped file until something needs
+them, so opening a notebook full of images costs about as much as reading
+its sources.
+"""
+import json
+import mmap
+import re
+
+import nbformat
+from nbformat.v4.rwbase import rejoin_lines, strip_transient
+
+
+_special = re.compile(rb'["\[\]{}]')
+_whitespace = re.compile(rb'[ \t\n\r]*')
+_scalar_end = re.compile(rb'[,\]}\s]')
+# arrays of strings, like sources and stream outputs, skipped in one match
+_string = rb'"[^"\\]*(?:\\.[^"\\]*)*"'
+_string_array = re.compile(
+    rb'\[\s*(?:' + _string + rb'\s*(?:,\s*' + _string + rb'\s*)*)?\]')
+
+_quote = ord('"')
+_backslash = ord('\\')
+_opening = (ord('['), ord('{'))
+
+
+def _skip_ws(data, pos):
+    return _whitespace.match(data, pos).end()
+
+
+def _skip_string(data, pos):
+    """ pos is at the opening quote, return the position after the closing
+    one. Long strings such as base64 images are skipped by find().
+    """
+    while True:
+        end = data.find(b'"', pos + 1)
+        if end < 0:
+            raise ValueError("Unterminated string in notebook")
+        escapes = 0
+        k = end - 1
+        while data[k] == _backslash:
+            escapes += 1
+            k -= 1
+        pos = end
+        if escapes % 2 == 0:
+            return end + 1
+
+
+def _skip_value(data, pos):
+    """ Return the end of the json value starting at pos, without decoding
+    it.
+    """
+    char = data[pos]
+    if char == _quote:
+        return _skip_string(data, pos)
+    if char not in _opening:
+        match = _scalar_end.search(data, pos)
+        return match.start() if match else len(data)
+    match = _string_array.match(data, pos)
+    if match is not None:
+        return match.end()
+    depth = 0
+    while True:
+        match = _special.search(data, pos)
+        if match is None:
+            raise ValueError("Unterminated value in notebook")
+        pos = match.start()
+        char = data[pos]
+        if char == _quote:
+            pos = _skip_string(data, pos)
+            continue
+        depth += 1 if char in _opening else -1
+        pos += 1
+        if depth == 0:
+            return pos
+
+
+def _expect(data, pos, char):
+    if data[pos:pos + 1] != char:
+        raise ValueError("Expected {0} at {1} in notebook".format(char, pos))
+
+
+def _members(data, pos, end=None):
+    """ Yield (key, value start, value end) of the object starting at pos.
+    If given, end[0] is set to the end of the object.
+    """
+    _expect(data, pos, b'{')
+    pos = _skip_ws(data, pos + 1)
+    while data[pos:pos + 1] != b'}':
+        key_end = _skip_string(data, pos)
+        key = data[pos + 1:key_end - 1]
+        key = json.loads(key) if b'\\' in key else key.decode('utf-8')
+        pos = _skip_ws(data, key_end)
+        _expect(data, pos, b':')
+        pos = _skip_ws(data, pos + 1)
+        value_end = _skip_value(data, pos)
+        yield key, pos, value_end
+        pos = _skip_ws(data, value_end)
+        if data[pos:pos + 1] == b',':
+            pos = _skip_ws(data, pos + 1)
+        else:
+            _expect(data, pos, b'}')
+    if end is not None:
+        end[0] = pos + 1
+
+
+class VimIpynbLazyOutputs():
+    """ Undecoded outputs of the cells of a notebook, by cell """
+
+    def __init__(self, data):
+        self.data = data
+        # id(cell) -> (cell, start, end) of the outputs in data
+        self.ranges = {}
+
+    def __contains__(self, cell):
+        return id(cell) in self.ranges
+
+    def __len__(self):
+        return len(self.ranges)
+
+    def add(self, cell, start, end):
+        self.ranges[id(cell)] = (cell, start, end)
+
+    def write(self, f, key):
+        """ Copy the outputs of the cell with id key into the binary file f,
+        as they are written in the notebook file.
+        """
+        _, start, end = self.ranges[key]
+        with memoryview(self.data) as view:
+            with view[start:end] as outputs:
+                f.write(outputs)
+
+    def move(self, cell, new_cell):
+        """ Let new_cell stand for cell, when cell is replaced """
+        if id(cell) in self.ranges:
+            _, start, end = self.ranges.pop(id(cell))
+            self.ranges[id(new_cell)] = (new_cell, start, end)
+
+    def load(self, cell):
+        """ Decode and return the outputs of cell """
+        _, start, end = self.ranges.pop(id(cell))
+        node = nbformat.from_dict({"cells": [{
+            "cell_type": "code",
+            "outputs": json.loads(self.data[start:end])}]})
+        rejoin_lines(node)
+        self.release()
+        return node.cells[0].outputs
+
+    def discard(self, cell):
+        self.ranges.pop(id(cell), None)
+        self.release()
+
+    def release(self):
+        """ Unmap the file once no output refers to it """
+        if not self.ranges and self.data is not None:
+            self.data.close()
+            self.data = None
+
+
+def read_notebook(filename):
+    """ Read a nbformat 4 notebook, leaving the outputs undecoded.
+
+    Return the notebook and its VimIpynbLazyOutputs. Raise ValueError for
+    anything this reader does not handle, callers fall back to nbformat.read.
+    """
+    with open(filename, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise ValueError("Empty notebook file")
+    try:
+        return _read(data)
+    except (ValueError, IndexError):
+        data.close()
+        raise ValueError("Cannot stream notebook " + filename)
+
+
+def _read(data):
+    nb = {}
+    cells_range = None
+    for key, start, end in _members(data, _skip_ws(data, 0)):
+        if key == "cells":
+            cells_range = (start, end)
+        else:
+            nb[key] = json.loads(data[start:end])
+    if nb.get("nbformat") != 4 or cells_range is None:
+        raise ValueError("Not a nbformat 4 notebook")
+
+    cells = []
+    output_ranges = []
+    pos = cells_range[0]
+    _expect(data, pos, b'[')
+    pos = _skip_ws(data, pos + 1)
+    cell_end = [pos]
+    while data[pos:pos + 1] != b']':
+        outputs = None
+        for key, start, end in _members(data, pos, cell_end):
+            if key == "outputs":
+                outputs = (start, end)
+        if outputs is None or \
+                data[_skip_ws(data, outputs[0] + 1)] == ord(']'):
+            cells.append(json.loads(data[pos:cell_end[0]]))
+        else:
+            # decode everything but the outputs
+            cells.append(json.loads(data[pos:outputs[0]] + b'[]' +
+                                    data[outputs[1]:cell_end[0]]))
+            output_ranges.append((len(cells) - 1, outputs))
+        pos = _skip_ws(data, cell_end[0])
+        if data[pos:pos + 1] == b',':
+            pos = _skip_ws(data, pos + 1)
+        else:
+            _expect(data, pos, b']')
+
+    nb["cells"] = cells
+    nb = nbformat.from_dict(nb)
+    rejoin_lines(nb)
+    strip_transient(nb)
+
+    lazy_outputs = VimIpynbLazyOutputs(data)
+    for n, (start, end) in output_ranges:
+        lazy_outputs.add(nb.cells[n], start, end)
+    lazy_outputs.release()
+    return nb, lazy_outputs
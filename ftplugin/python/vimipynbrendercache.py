@@ -0,0 +1,209 @@
+""" On disk cache of the html and markdown rendering of each cell
+
+Used by the export worker. Only the cells missing from the cache are
+rendered, all at once with placeholder raw cells between them to cut the
+result into one fragment per cell. The notebook is then rendered with every
+cell replaced by a placeholder, and the placeholders by the fragments.
+
+The cache lives in .vim-ipynb-cache next to the notebook. Entries are keyed
+by the cell content and the exporter configuration, the least recently used
+are removed once the cache is above g:ipynb_render_cache_size bytes.
+"""
+import base64
+import copy
+import datetime
+import hashlib
+import json
+import os
+import re
+import sys
+import tempfile
+
+import nbconvert
+import nbformat
+from nbconvert.exporters.exporter import ResourcesDict
+from nbconvert.preprocessors import Preprocessor
+
+
+cache_dir_name = ".vim-ipynb-cache"
+placeholder = "@vim-ipynb-cell:{0}@"
+placeholder_pattern = re.compile(r"@vim-ipynb-cell:(\d+)@")
+
+
+class VimIpynbCellKeys(Preprocessor):
+    """ Name the outputs extracted from a cell after its cache key rather
+    than its position, so a cached fragment still points to its own files
+    when cells are moved.
+    """
+
+    def preprocess_cell(self, cell, resources, cell_index):
+        key = resources.get("vim_ipynb_cell_keys", {}).get(cell_index)
+        if key is None:
+            return cell, resources
+        extracted = resources.get("outputs", {})
+        for index, output in enumerate(cell.get("outputs", [])):
+            filenames = output.get("metadata", {}).get("filenames", {})
+            for mime, filename in list(filenames.items()):
+                directory, name = os.path.split(filename)
+                new_name = os.path.join(directory, "{0}_{1}_{2}{3}".format(
+                    resources.get("unique_key", "output"), key[:16], index,
+                    os.path.splitext(name)[1]))
+                filenames[mime] = new_name
+                if filename in extracted:
+                    extracted[new_name] = extracted.pop(filename)
+        return cell, resources
+
+
+class VimIpynbRenderCache():
+
+    def __init__(self, notebook_path, max_size):
+        self.path = os.path.join(os.path.dirname(notebook_path),
+                                 cache_dir_name)
+        self.max_size = max_size
+
+    def entry_path(self, key):
+        return os.path.join(self.path, key + ".json")
+
+    def get(self, key):
+        path = self.entry_path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+            # keep recently used entries on eviction
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return entry
+
+    def put(self, key, fragment, outputs):
+        entry = {"fragment": fragment,
+                 "outputs": {name: base64.b64encode(data).decode("ascii")
+                             for name, data in outputs.items()}}
+        os.makedirs(self.path, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.path)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, self.entry_path(key))
+        return entry
+
+    def evict(self):
+        """ Remove the least recently used entries above max_size """
+        try:
+            entries = [(e.stat().st_mtime, e.stat().st_size, e.path)
+                       for e in os.scandir(self.path)
+                       if e.name.endswith(".json")]
+        except OSError:
+            return
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+
+
+def notebook_resources(filename):
+    """ The resources exporter.from_filename would start from """
+    resources = ResourcesDict()
+    resources["metadata"] = ResourcesDict()
+    path, basename = os.path.split(filename)
+    resources["metadata"]["name"] = os.path.splitext(basename)[0]
+    resources["metadata"]["path"] = path
+    modified_date = datetime.datetime.fromtimestamp(
+        os.path.getmtime(filename), tz=datetime.timezone.utc)
+    date_format = "%B %d, %Y" if sys.platform == "win32" else "%B %-d, %Y"
+    resources["metadata"]["modified_date"] = modified_date.strftime(
+        date_format)
+    return resources
+
+
+def placeholder_cell(n):
+    return nbformat.v4.new_raw_cell(placeholder.format(n))
+
+
+def split_placeholders(body):
+    """ Return {n: text up to placeholder n} and the text after the last """
+    parts = {}
+    pos = 0
+    for match in placeholder_pattern.finditer(body):
+        parts[int(match.group(1))] = body[pos:match.start()]
+        pos = match.end()
+    return parts, body[pos:]
+
+
+def render_cached(exporter, filename, cache):
+    """ Convert the notebook filename like exporter.from_filename, taking
+    the fragments of unchanged cells from cache.
+    """
+    nb = nbformat.read(filename, as_version=4)
+    resources = notebook_resources(filename)
+    config_key = json.dumps([nbconvert.__version__, type(exporter).__name__,
+                             getattr(exporter, "template_name", ""),
+                             getattr(exporter, "template_file", ""),
+                             repr(exporter.config), nb.metadata,
+                             resources["metadata"]["name"]],
+                            sort_keys=True, default=str)
+    keys = []
+    for cell in nb.cells:
+        data = config_key + json.dumps(cell, sort_keys=True, default=str)
+        keys.append(hashlib.sha256(data.encode("utf-8")).hexdigest())
+
+    # the notebook with a placeholder in place of each cell, and one more
+    # after them to find the separator put between cells
+    skeleton = nbformat.v4.new_notebook(metadata=nb.metadata)
+    skeleton.cells = [placeholder_cell(n) for n in range(len(nb.cells) + 1)]
+    body, skeleton_resources = exporter.from_notebook_node(
+        skeleton, resources=copy.deepcopy(resources))
+    skeleton_parts, tail = split_placeholders(body)
+    separator = skeleton_parts[len(nb.cells)] if nb.cells else ""
+
+    entries = {}
+    dirty = []
+    for key, cell in zip(keys, nb.cells):
+        if key in entries:
+            continue
+        entries[key] = cache.get(key)
+        if entries[key] is None:
+            dirty.append((key, cell))
+
+    if dirty:
+        batch = nbformat.v4.new_notebook(metadata=nb.metadata)
+        batch.cells.append(placeholder_cell(0))
+        cell_keys = {}
+        for n, (key, cell) in enumerate(dirty):
+            cell_keys[len(batch.cells)] = key
+            batch.cells.append(cell)
+            batch.cells.append(placeholder_cell(n + 1))
+        batch_resources = copy.deepcopy(resources)
+        batch_resources["vim_ipynb_cell_keys"] = cell_keys
+        body, batch_resources = exporter.from_notebook_node(
+            batch, resources=batch_resources)
+        batch_parts, _ = split_placeholders(body)
+        extracted = batch_resources.get("outputs", {})
+        for n, (key, _) in enumerate(dirty):
+            fragment = batch_parts[n + 1]
+            if separator and fragment.startswith(separator):
+                fragment = fragment[len(separator):]
+            if separator and fragment.endswith(separator):
+                fragment = fragment[:-len(separator)]
+            outputs = {name: data for name, data in extracted.items()
+                       if os.path.basename(name) in fragment}
+            entries[key] = cache.put(key, fragment, outputs)
+        cache.evict()
+
+    pieces = []
+    outputs = skeleton_resources.setdefault("outputs", {})
+    for n, key in enumerate(keys):
+        pieces.append(skeleton_parts[n])
+        pieces.append(entries[key]["fragment"])
+        for name, data in entries[key]["outputs"].items():
+            outputs[name] = base64.b64decode(data)
+    # what is left before the extra placeholder is the separator, dropped
+    if not nb.cells:
+        pieces.append(skeleton_parts[0])
+    pieces.append(tail)
+    # as the exporter does with the whole output
+    return "".join(pieces).lstrip("\r\n"), skeleton_resources
@@ -33,6 +33,8 @@ from jupyter_client.localinterfaces import localhost
 
 
 from vimjupytershell import VimJupyterShell
+from vimjupyterkernelpool import kernel_pool
+from vimjupytersharedkernels import find_shared_kernel, share_kernel
 from _version import __version__
 
 ConnectionFileMixin = connect.ConnectionFileMixin
@@ -66,6 +68,8 @@ class VimJupyter(ConnectionFileMixin):
     kernel_manager_class = KernelManager
     kernel_client_class = BlockingKernelClient
     kernel_manager = None
+    # VimJupyterSharedKernel when the kernel is shared with other notebooks
+    shared_kernel = None
 
     kernel_argv = List(Unicode())
 
@@ -226,6 +230,27 @@ class VimJupyter(ConnectionFileMixin):
             return
         signal.signal(signal.SIGINT, signal.SIG_DFL)
 
+        # a kernel started ahead of time, or a new one
+        self.kernel_manager = kernel_pool.take(self.kernel_name)
+        if self.kernel_manager is None:
+            self.start_kernel_manager()
+        km = self.kernel_manager
+        atexit.register(km.cleanup_ipc_files)
+
+        if self.sshserver:
+            # ssh, write new connection file
+            km.write_connection_file()
+
+        # in case KM defaults / ssh writing changes things:
+        self.shell_port = km.shell_port
+        self.iopub_port = km.iopub_port
+        self.stdin_port = km.stdin_port
+        self.hb_port = km.hb_port
+        self.connection_file = km.connection_file
+
+        atexit.register(km.cleanup_connection_file)
+
+    def start_kernel_manager(self):
         # Create a KernelManager and start a kernel.
         try:
             self.kernel_manager = self.kernel_manager_class(
@@ -251,24 +276,15 @@ class VimJupyter(ConnectionFileMixin):
         if self.kernel_manager.ipykernel:
             kwargs['extra_arguments'] = self.kernel_argv
         self.kernel_manager.start_kernel(**kwargs)
-        atexit.register(self.kernel_manager.cleanup_ipc_files)
-
-        if self.sshserver:
-            # ssh, write new connection file
-            self.kernel_manager.write_connection_file()
-
-        # in case KM defaults / ssh writing changes things:
-        km = self.kernel_manager
-        self.shell_port = km.shell_port
-        self.iopub_port = km.iopub_port
-        self.stdin_port = km.stdin_port
-        self.hb_port = km.hb_port
-        self.connection_file = km.connection_file
-
-        atexit.register(self.kernel_manager.cleanup_connection_file)
 
     def init_kernel_client(self):
-        if self.kernel_manager is not None:
+        if self.shared_kernel is not None:
+            # a session of its own, the notebooks sharing the kernel tell
+            # their messages apart by it
+            self.kernel_client = self.kernel_client_class()
+            self.kernel_client.load_connection_info(
+                self.kernel_manager.get_connection_info())
+        elif self.kernel_manager is not None:
             self.kernel_client = self.kernel_manager.client()
         else:
             self.kernel_client = self.kernel_client_class(
@@ -293,11 +309,30 @@ class VimJupyter(ConnectionFileMixin):
             client=self.kernel_client
         )
         self.shell.own_kernel = not self.existing
+        self.shell.shared_kernel = self.shared_kernel
+        if self.shared_kernel is not None:
+            self.shared_kernel.attach(self.kernel_client.session.session)
 
     def set_kernel_name(self, kernel_name="python"):
         self.kernel_name = kernel_name
 
-    def initialize(self, existing="", argv=None):
+    def release_kernel(self):
+        """ Let go of the kernel: shut it down in the background if it is
+        the own kernel of the notebook, or it is shared and no other notebook
+        uses it
+        """
+        if self.kernel_manager is None or \
+                not self.kernel_manager.is_alive():
+            return
+        self.kernel_client.stop_channels()
+        if self.shared_kernel is None or self.shared_kernel.release(
+                self.kernel_client.session.session):
+            kernel_pool.dispose(self.kernel_manager)
+
+    def initialize(self, existing="", argv=None, shared_key=None):
+        """ Start or connect to a kernel. With shared_key, the kernel shared
+        under that key is used, or the one started is shared under it.
+        """
 
         # if self._dispatching:
         #     return
@@ -310,16 +345,23 @@ class VimJupyter(ConnectionFileMixin):
         if not os.path.isdir(self.runtime_dir):
             os.mkdir(self.runtime_dir)
 
-        if self.kernel_manager is not None and\
-                self.kernel_manager.is_alive():
-            # first, shutdown the old kernel if own one
-            self.kernel_manager.shutdown_kernel(restart=False)
+        # first, shutdown the old kernel if own one
+        self.release_kernel()
 
         #print(self.kernel_name)
 
         self.init_connection_file()
         self.init_ssh()
-        self.init_kernel_manager()
+        self.shared_kernel = None
+        if shared_key is not None and not self.existing:
+            self.shared_kernel = find_shared_kernel(shared_key)
+        if self.shared_kernel is not None:
+            self.kernel_manager = self.shared_kernel.kernel_manager
+        else:
+            self.init_kernel_manager()
+            if shared_key is not None and self.kernel_manager is not None:
+                self.shared_kernel = share_kernel(
+                    shared_key, self.kernel_manager)
         self.init_kernel_client()
         self.init_shell()
 
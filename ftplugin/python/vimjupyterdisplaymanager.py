@@ -1,4 +1,9 @@
 
+import collections
+import os
+import tempfile
+import time
+
 import vim
 
 
@@ -16,6 +21,18 @@ class VimJupterDisplayManager():
     stdout_dir = "above"
     stdout_last_row = 0
 
+    # output is written to the window at most g:ipynb_output_refresh_rate
+    # times per second. Lines appended since, or after a clear_output() the
+    # lines of the latest frame, the last g:ipynb_output_window_lines only.
+    pending_lines = None
+    pending_overflow = False
+    frame_lines = None
+    frame_dirty = False
+    frame_rendered = 0
+
+    # every line of the output, the window only keeps the last ones
+    spill_file = None
+
     # ratio for window split
     w_origin_ID = 0
 
@@ -24,7 +41,10 @@ class VimJupterDisplayManager():
     win_gotoid = vim.Function("win_gotoid")
 
     def __init__(self):
-        pass
+        self.pending_lines = collections.deque(maxlen=self.window_lines())
+
+    def window_lines(self):
+        return max(1, int(vim.vars.get("ipynb_output_window_lines", 10000)))
 
     def set_window_dir(self, wdir):
         self.wdir = wdir
@@ -97,32 +117,157 @@ class VimJupterDisplayManager():
         if msg:
             msg = msg.rstrip()
             msg_list = msg.split('\n')
-            for n in range(len(msg_list)):
-                if self.align >= 0:
-                    msg_list[n] = ' '*(self.align) + '> ' + msg_list[n]
+            if self.align >= 0:
+                prefix = ' '*(self.align) + '> '
+                msg_list = [prefix + line for line in msg_list]
 
-            self.stdout_buffer.append(msg_list, self.stdout_last_row)
-            self.stdout_last_row += len(msg_list)
+            self.append_lines(msg_list)
             self.align = -1
 
     def handle_prompt(self, prompt=""):
         if prompt:
             self.align = prompt.lstrip().find(":")
             msg_list = prompt.split('\n')
-            self.stdout_buffer.append(msg_list, self.stdout_last_row)
-            self.stdout_last_row += len(msg_list)
+            self.append_lines(msg_list)
+
+    def append_lines(self, msg_list):
+        self.spill(msg_list)
+        if self.frame_lines is not None:
+            self.frame_lines.extend(msg_list)
+            self.frame_dirty = True
+        else:
+            if len(self.pending_lines) + len(msg_list) > \
+                    self.pending_lines.maxlen:
+                self.pending_overflow = True
+            self.pending_lines.extend(msg_list)
+        self.render_frame()
 
     def clear_stdout_buffer(self):
+        self.pending_lines = collections.deque(maxlen=self.window_lines())
+        self.pending_overflow = False
+        self.clear_spill()
         if self.stdout_buffer is not None:
             self.stdout_buffer[:] = None
 
-    def finish_stdout(self):
-        cmd = "set readonly nomodifiable"
+    def clear_frame(self):
+        """ Handle clear_output(): the window only shows what comes next.
+        Frames replaced before being rendered never reach vim.
+        """
+        self.frame_lines = collections.deque(maxlen=self.window_lines())
+        self.frame_dirty = True
+        self.pending_lines.clear()
+        self.pending_overflow = False
+        self.clear_spill()
+        self.render_frame()
+
+    def flush_timeout(self):
+        """ Seconds before the lines waiting are due in the window, None if
+        there are none
+        """
+        if not self.pending_lines and not self.frame_dirty:
+            return None
+        rate = vim.vars.get("ipynb_output_refresh_rate", 10)
+        if rate <= 0:
+            return 0
+        return max(0, self.frame_rendered + 1.0 / rate - time.monotonic())
+
+    def render_frame(self, force=False):
+        """ Write the lines waiting to the window if it is time to, return
+        whether it was
+        """
+        now = time.monotonic()
+        rate = vim.vars.get("ipynb_output_refresh_rate", 10)
+        if not force and rate > 0 and now - self.frame_rendered < 1.0 / rate:
+            return False
+        if not self.pending_lines and not self.frame_dirty:
+            return False
+        self.frame_rendered = now
+        if self.frame_lines is not None:
+            self.stdout_buffer[:] = list(self.frame_lines)
+            self.stdout_last_row = len(self.frame_lines)
+            self.frame_dirty = False
+        else:
+            lines = list(self.pending_lines)
+            self.pending_lines.clear()
+            if self.pending_overflow:
+                # the older lines are all pushed out of the window
+                self.stdout_buffer[:] = lines
+                self.stdout_last_row = len(lines)
+                self.pending_overflow = False
+            else:
+                self.stdout_buffer.append(lines, self.stdout_last_row)
+                self.stdout_last_row += len(lines)
+            excess = self.stdout_last_row - self.window_lines()
+            if excess > 0:
+                self.stdout_buffer[0:excess] = None
+                self.stdout_last_row -= excess
+        if not force:
+            vim.command("redraw")
+        return True
+
+    def spill(self, lines):
+        if self.spill_file is None:
+            self.spill_file = tempfile.NamedTemporaryFile(
+                "w", prefix="vim-jupyter-output-", suffix=".txt",
+                delete=False, encoding="utf-8")
+        self.spill_file.write("\n".join(lines) + "\n")
+
+    def clear_spill(self):
+        if self.spill_file is not None:
+            self.spill_file.seek(0)
+            self.spill_file.truncate()
+
+    def open_spill(self):
+        """ Open the whole output of the last run in a split """
+        if self.spill_file is None:
+            vim.command("echo \"No output yet\"")
+            return
+        self.spill_file.flush()
+        vim.command("sview " + self.spill_file.name)
+
+    def close(self):
+        if self.spill_file is not None:
+            self.spill_file.close()
+            try:
+                os.unlink(self.spill_file.name)
+            except OSError:
+                pass
+            self.spill_file = None
+
+    def render_last_frame(self):
+        """ Write the final frame of a run, <No Output> if it is empty """
+        self.render_frame(force=True)
+        self.frame_lines = None
         if self.stdout_last_row == 0:
             self.handle_stdout("<No Output>")
+            # handle_stdout only renders if it is time to
+            self.render_frame(force=True)
+        if self.spill_file is not None:
+            self.spill_file.flush()
+
+    def finish_stdout(self):
+        self.render_last_frame()
+        cmd = "set readonly nomodifiable"
         vim.command(cmd)
         self.win_gotoid(self.w_origin_ID)
 
+    def open_background(self, clear_display=True):
+        """ Show the output window and go back to the current one, the
+        output of cells running in the background is written from timers.
+        """
+        self.open_window("stdout", clear_display)
+        vim.command("set readonly nomodifiable")
+        self.win_gotoid(self.w_origin_ID)
+
+    def set_modifiable(self, modifiable):
+        if self.stdout_buffer is not None and self.stdout_buffer.valid:
+            self.stdout_buffer.options["modifiable"] = modifiable
+            self.stdout_buffer.options["readonly"] = not modifiable
+
+    def finish_background(self):
+        """ finish_stdout() without leaving the current window """
+        self.render_last_frame()
+
     def handle_stdin(self, prompt):
         f = vim.Function("input")
         return f(prompt).decode('utf-8')
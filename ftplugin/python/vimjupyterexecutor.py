@@ -0,0 +1,456 @@
+""" Execution of cells
+
+A VimJupyterExecutor sends the execute requests of a shell all at once and
+routes the messages of the kernel to the cells by parent_header.msg_id.
+
+With g:ipynb_background_execution, the cells are sent to the kernel by a
+VimJupyterKernelWorker thread. It has its own connection to the kernel and
+puts every message it receives in a queue. The IpynbDrainKernels() timer
+hands the queued messages to the shells a few at a time, taking turns
+between notebooks, so vim stays usable while cells run.
+"""
+import collections
+import datetime
+import threading
+import time
+
+try:
+    from queue import Queue, Empty  # Py 3
+except ImportError:
+    from Queue import Queue, Empty  # Py 2
+
+import vim
+
+from vimipynboutputbudget import output_size
+
+
+def background_enabled():
+    return bool(int(vim.vars.get("ipynb_background_execution", 0))) and \
+        bool(int(vim.eval("exists('*timer_start')")))
+
+
+class VimJupyterKernelWorker():
+    """ Thread exchanging messages with the kernel for one shell """
+
+    def __init__(self, client, timeout=60):
+        self.connection_info = client.get_connection_info()
+        self.timeout = timeout
+        # (channel, msg, time received), channel "dead" if the kernel never
+        # answered
+        self.events = Queue()
+        self.commands = Queue()
+        import zmq
+        self.context = zmq.Context.instance()
+        address = "inproc://vim-jupyter-worker-{0}".format(id(self))
+        self.wakeup = self.context.socket(zmq.PAIR)
+        self.wakeup.bind(address)
+        self.waker = self.context.socket(zmq.PAIR)
+        self.waker.connect(address)
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, args=(address,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def send(self, kind, content=None):
+        """ kind is "execute" with a prebuilt execute_request, "input" with
+        the text of an input_reply, or "stop"
+        """
+        self.commands.put((kind, content))
+        with self.lock:
+            if self.waker is not None:
+                self.waker.send(b"")
+
+    def stop(self):
+        self.send("stop")
+        self.thread.join(1)
+        with self.lock:
+            self.waker.close(linger=0)
+            self.waker = None
+
+    def run(self, address):
+        import zmq
+        from jupyter_client import BlockingKernelClient
+        client = BlockingKernelClient()
+        # a session of its own: the kernel tells clients apart by session id
+        client.load_connection_info(self.connection_info)
+        try:
+            client.wait_for_ready(timeout=self.timeout)
+        except RuntimeError:
+            self.events.put(("dead", None, time.monotonic()))
+        channels = [(client.iopub_channel, "iopub"),
+                    (client.stdin_channel, "stdin"),
+                    (client.shell_channel, "shell")]
+        poller = zmq.Poller()
+        poller.register(self.wakeup, zmq.POLLIN)
+        for channel, _ in channels:
+            poller.register(channel.socket, zmq.POLLIN)
+        try:
+            while True:
+                events = dict(poller.poll())
+                if self.wakeup in events:
+                    while self.wakeup.poll(0):
+                        self.wakeup.recv()
+                    if not self.run_commands(client):
+                        break
+                for channel, kind in channels:
+                    if channel.socket in events:
+                        while channel.msg_ready():
+                            self.events.put((kind, channel.get_msg(timeout=0),
+                                             time.monotonic()))
+        finally:
+            self.wakeup.close(linger=0)
+            client.stop_channels()
+
+    def run_commands(self, client):
+        """ Send what the shell asked for, return False on stop """
+        while True:
+            try:
+                kind, content = self.commands.get_nowait()
+            except Empty:
+                return True
+            if kind == "stop":
+                return False
+            elif kind == "execute":
+                client.shell_channel.send(content)
+            elif kind == "input":
+                client.input(content)
+
+
+def timestamp(date=None):
+    """ ISO 8601 in UTC, as JupyterLab writes the execution metadata """
+    if date is None:
+        date = datetime.datetime.now(datetime.timezone.utc)
+    elif not isinstance(date, datetime.datetime):
+        return date
+    elif date.tzinfo is not None:
+        date = date.astimezone(datetime.timezone.utc)
+    return date.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+class VimJupyterRequest():
+    """ An execute request sent for a cell """
+    __slots__ = ("name", "clear_display", "started", "replied", "idle",
+                 "aborted", "status", "execution", "output_size", "reply",
+                 "on_reply")
+
+    def __init__(self, name, clear_display, on_reply=None):
+        self.name = name
+        self.clear_display = clear_display
+        self.started = False
+        self.replied = False
+        self.idle = False
+        # given up after the error of an earlier request
+        self.aborted = False
+        self.status = None
+        # the cell metadata.execution of JupyterLab, with the times seen by
+        # the frontend and the size of the output
+        self.execution = {"vim-ipynb.submitted": timestamp()}
+        self.output_size = 0
+        self.reply = None
+        # called with the execute reply once the request is finished
+        self.on_reply = on_reply
+
+
+class VimJupyterExecutor():
+    """ The execute requests of a shell waiting for the kernel. They are
+    all sent at once, the kernel queues them, and its messages are routed to
+    the cells by parent_header.msg_id.
+    """
+
+    def __init__(self, shell):
+        self.shell = shell
+        self.worker = None
+        self.background = False
+        # msg_id -> VimJupyterRequest, in the order sent
+        self.requests = collections.OrderedDict()
+        self.next_check = 0
+        # VimJupyterTracer of the requests sent, None unless tracing
+        self.tracer = None
+        # msg_id of the requests finished, traced until their output is
+        # in the window
+        self.traces_done = []
+        # (on_reply, reply) of the requests finished, see run_callbacks
+        self.replies = []
+
+    @property
+    def busy(self):
+        return bool(self.requests) or \
+            (self.worker is not None and not self.worker.events.empty())
+
+    def submit(self, cells, clear_display=True, store_history=True,
+               background=True, silent=False, user_expressions=None,
+               on_reply=None):
+        """ Send execute requests for the (code, name) cells. Without
+        background, the caller hands the messages of the shell client to
+        dispatch() and calls run_callbacks() once done.
+        """
+        self.background = background
+        self.tracer = self.shell.tracer()
+        if background:
+            if self.worker is None:
+                self.worker = VimJupyterKernelWorker(
+                    self.shell.client, self.shell.kernel_timeout)
+            display = self.shell.vim_display_manager
+            if not self.requests or display.bufwinid(
+                    display.stdout_buffer_name or "") == -1:
+                display.open_background(clear_display=False)
+        if not self.requests:
+            self.next_check = time.monotonic() + \
+                self.shell.kernel_alive_interval
+        self.shell._executing = True
+        self.shell._execution_state = "busy"
+        for code, name in cells:
+            # built here so the session is the one of the shell
+            msg = self.shell.client.session.msg("execute_request", dict(
+                code=code, silent=silent, store_history=store_history,
+                user_expressions=user_expressions or {}, allow_stdin=True,
+                stop_on_error=True))
+            self.requests[msg["header"]["msg_id"]] = VimJupyterRequest(
+                name, clear_display, on_reply)
+            if self.tracer is not None:
+                self.tracer.start(msg["header"]["msg_id"], name)
+            if background:
+                self.worker.send("execute", msg)
+            else:
+                self.shell.client.shell_channel.send(msg)
+        if background:
+            start_draining(self)
+
+    def start(self, request):
+        """ The kernel started on request """
+        request.started = True
+        if request.clear_display:
+            display = self.shell.vim_display_manager
+            display.clear_stdout_buffer()
+            display.stdout_last_row = 0
+        self.shell.vim_ipynb_formatter.clear_output(request.name)
+
+    def finish(self, msg_id):
+        request = self.requests.pop(msg_id)
+        if self.tracer is not None:
+            self.traces_done.append(msg_id)
+        if request.status in ("ok", "error") and request.name:
+            request.execution["vim-ipynb.done"] = timestamp()
+            self.shell.vim_ipynb_formatter.set_execution(
+                request.name, request.execution, request.output_size)
+        if request.on_reply is not None:
+            self.replies.append((request.on_reply, request.reply))
+        if not self.requests:
+            self.shell._executing = False
+            if self.background:
+                self.shell.vim_display_manager.finish_background()
+                self.rendered()
+        if self.background:
+            self.run_callbacks()
+
+    def run_callbacks(self):
+        """ Call the on_reply of the requests finished with their reply,
+        once the output window is done with
+        """
+        while self.replies:
+            on_reply, reply = self.replies.pop(0)
+            on_reply(reply)
+
+    def drain(self, limit):
+        """ Handle up to limit messages from the worker, return how many """
+        if self.worker is None:
+            return 0
+        display = self.shell.vim_display_manager
+        count = 0
+        display.set_modifiable(True)
+        try:
+            while count < limit:
+                try:
+                    kind, msg, received = self.worker.events.get_nowait()
+                except Empty:
+                    break
+                count += 1
+                self.dispatch(kind, msg, received)
+            self.render()
+        finally:
+            display.set_modifiable(False)
+        return count
+
+    def render(self):
+        """ Write the output waiting to the window, if it is time to """
+        if self.shell.vim_display_manager.render_frame():
+            self.rendered()
+
+    def rendered(self):
+        """ A frame was written to the window: the traces of the requests
+        finished are complete with it
+        """
+        if self.tracer is None:
+            return
+        self.tracer.rendered(list(self.requests) + self.traces_done)
+        for msg_id in self.traces_done:
+            self.tracer.finish(msg_id)
+        self.traces_done = []
+
+    def dispatch(self, kind, msg, received=None):
+        """ Handle a message of the kernel, kind is the channel """
+        if kind == "dead":
+            self.kernel_died()
+            return
+        msg_id = msg["parent_header"].get("msg_id")
+        request = self.requests.get(msg_id)
+        if request is None:
+            # from another client, or a request already finished
+            if kind == "iopub":
+                self.shell.dispatch_iopub(msg, "")
+            return
+        if self.tracer is not None and received is None:
+            received = time.monotonic()
+        if kind == "shell":
+            request.reply = msg
+        if request.aborted:
+            # only the reply and status of requests given up are left
+            if kind == "iopub" and msg["msg_type"] != "status":
+                self.shell.dispatch_iopub(msg, request.name)
+        else:
+            self.handle(kind, msg, msg_id, request)
+        if self.tracer is not None:
+            self.tracer.hop(msg_id, msg["msg_type"], received,
+                            time.monotonic(), msg)
+        if (request.aborted and kind == "shell") or \
+                (request.replied and request.idle):
+            self.finish(msg_id)
+
+    def handle(self, kind, msg, msg_id, request):
+        if not request.started:
+            self.start(request)
+        name = request.name
+        if kind == "iopub":
+            self.shell.dispatch_iopub(msg, name)
+            self.record(request, msg)
+        elif kind == "stdin":
+            raw_data = self.shell.read_input(msg, msg_id)
+            if raw_data is not None:
+                if self.background:
+                    self.worker.send("input", raw_data)
+                else:
+                    self.shell.client.input(raw_data)
+        elif kind == "shell":
+            self.shell.dispatch_execute_reply(msg, msg_id, name)
+            request.replied = True
+            request.status = msg["content"]["status"]
+            if "started" in msg["metadata"]:
+                request.execution["shell.execute_reply.started"] = \
+                    timestamp(msg["metadata"]["started"])
+            request.execution["shell.execute_reply"] = timestamp(
+                msg["header"]["date"])
+            if msg["content"]["status"] == "error":
+                self.abort_after(msg_id)
+
+    def record(self, request, msg):
+        """ Note the time of the iopub messages of request """
+        msg_type = msg["msg_type"]
+        if msg_type == "status":
+            state = msg["content"]["execution_state"]
+            if state in ("busy", "idle"):
+                request.execution["iopub.status." + state] = timestamp(
+                    msg["header"]["date"])
+            request.idle = request.idle or state == "idle"
+        elif msg_type == "execute_input":
+            request.execution["iopub.execute_input"] = timestamp(
+                msg["header"]["date"])
+        elif msg_type in ("stream", "execute_result", "display_data",
+                          "error"):
+            request.output_size += output_size(
+                dict(msg["content"], output_type=msg_type))
+
+    def abort_after(self, msg_id):
+        """ The kernel aborts what was queued after an error """
+        ids = list(self.requests)
+        aborted = ids[ids.index(msg_id) + 1:]
+        for later in aborted:
+            self.requests[later].aborted = True
+        if aborted:
+            self.shell.vim_display_manager.handle_stdout(
+                "{0} cell(s) not run after the error".format(len(aborted)))
+
+    def check_alive(self):
+        if not self.requests or time.monotonic() < self.next_check:
+            return
+        self.next_check = time.monotonic() + self.shell.kernel_alive_interval
+        if not self.shell.client.is_alive():
+            self.kernel_died()
+
+    def kernel_died(self):
+        self.shell.kernel_ready = False
+        if not self.requests:
+            return
+        display = self.shell.vim_display_manager
+        self.requests.clear()
+        self.shell._executing = False
+        display.handle_stdout("The kernel is not alive")
+        if self.background:
+            display.finish_background()
+
+    def interrupt(self):
+        """ Interrupt the cell running, the kernel aborts the ones queued """
+        if not self.requests:
+            return
+        if self.shell.manager is not None:
+            self.shell.manager.interrupt_kernel()
+        else:
+            msg = self.shell.client.session.msg("interrupt_request", {})
+            self.shell.client.control_channel.send(msg)
+
+    def stop(self):
+        self.requests.clear()
+        self.replies = []
+        self.traces_done = []
+        self.shell._executing = False
+        if self.worker is not None:
+            self.worker.stop()
+            self.worker = None
+        if self in _executors:
+            _executors.remove(self)
+
+
+# executors with cells running or messages left, in turn order
+_executors = []
+_timer = None
+drain_interval = 20
+# seconds a timer callback may spend, and messages per executor per turn
+drain_budget = 0.01
+drain_slice = 16
+
+
+def start_draining(executor):
+    global _timer
+    if executor not in _executors:
+        _executors.append(executor)
+    if _timer is None:
+        _timer = int(vim.eval(
+            "timer_start({0}, 'IpynbDrainKernels', {{'repeat': -1}})".format(
+                drain_interval)))
+
+
+def drain_executors():
+    """ Called from the IpynbDrainKernels() timer in ftplugin/ipynb.vim """
+    global _timer
+    deadline = time.monotonic() + drain_budget
+    while time.monotonic() < deadline:
+        handled = 0
+        for executor in list(_executors):
+            handled += executor.drain(drain_slice)
+            if time.monotonic() >= deadline:
+                break
+        if handled == 0:
+            break
+    for executor in list(_executors):
+        executor.shell.vim_display_manager.set_modifiable(True)
+        try:
+            executor.check_alive()
+        finally:
+            executor.shell.vim_display_manager.set_modifiable(False)
+        if not executor.busy:
+            _executors.remove(executor)
+    if len(_executors) > 1:
+        # the next callback starts with another notebook
+        _executors.append(_executors.pop(0))
+    if not _executors and _timer is not None:
+        vim.eval("timer_stop({0})".format(_timer))
+        _timer = None
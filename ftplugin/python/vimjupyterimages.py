@@ -0,0 +1,174 @@
+""" Display of image outputs off the message loop
+
+handle_rich_data() hands each image to the VimJupyterImagePipeline of the
+shell. Its thread decodes the image, saves it once per content hash into a
+directory of its own, shrinks figures larger than image_thumbnail_size
+(with Pillow, when installed) and shows it with the image_handler of the
+shell. The 'directory' handler starts one viewer on that directory, which
+picks up the images as they are added.
+"""
+import base64
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+try:
+    from queue import Queue  # Py 3
+except ImportError:
+    from Queue import Queue  # Py 2
+
+
+image_extensions = {
+    'image/png': 'png',
+    'image/jpeg': 'jpeg',
+    'image/svg+xml': 'svg',
+}
+
+
+class VimJupyterImagePipeline():
+
+    def __init__(self, shell):
+        self.shell = shell
+        self.jobs = Queue()
+        self.thread = None
+        self.path = None
+        # content hash -> file shown, for the images of this shell
+        self.images = {}
+        self.viewer = None
+        # stream viewers still running, reaped as new images come
+        self.processes = []
+
+    def submit(self, data, mime):
+        """ Queue the base64 data of an image, return whether the handler
+        can show it
+        """
+        if mime not in image_extensions:
+            return False
+        if self.shell.image_handler == 'PIL' and \
+                (mime == 'image/svg+xml' or not pillow_available()):
+            return False
+        if self.thread is None:
+            self.path = tempfile.mkdtemp(prefix="vim-jupyter-images-")
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+        self.jobs.put((data, mime))
+        return True
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            try:
+                self.show(*job)
+            except Exception:
+                # a broken image or viewer must not stop the next ones
+                pass
+
+    def show(self, data, mime):
+        if isinstance(data, str):
+            data = data.encode('ascii')
+        digest = hashlib.sha256(data).hexdigest()[:32]
+        if digest in self.images:
+            # shown already
+            return
+        path = self.save(digest, base64.decodebytes(data), mime)
+        self.images[digest] = path
+        handler = getattr(self, 'show_{0}'.format(self.shell.image_handler),
+                          None)
+        if handler is not None:
+            self.reap()
+            handler(path, image_extensions[mime])
+
+    def save(self, digest, raw, mime):
+        """ Write the image, or its thumbnail if it is too large. Files are
+        numbered so the viewer lists them in the order they came.
+        """
+        name = "{0:05d}-{1}".format(len(self.images), digest)
+        size = self.shell.image_thumbnail_size
+        if size > 0 and mime != 'image/svg+xml' and pillow_available():
+            from PIL import Image
+            from io import BytesIO
+            img = Image.open(BytesIO(raw))
+            if max(img.size) > size:
+                img.thumbnail((size, size))
+                path = os.path.join(self.path, name + ".png")
+                img.save(path + ".tmp", format="PNG")
+                os.replace(path + ".tmp", path)
+                return path
+        path = os.path.join(self.path, name + "." + image_extensions[mime])
+        # renamed into place, the viewer never sees half an image
+        with open(path + ".tmp", "wb") as f:
+            f.write(raw)
+        os.replace(path + ".tmp", path)
+        return path
+
+    def reap(self):
+        self.processes = [p for p in self.processes if p.poll() is None]
+
+    def show_directory(self, path, imageformat):
+        if self.viewer is not None and self.viewer.poll() is None:
+            return
+        fmt = dict(directory=self.path, file=path, format=imageformat)
+        args = [s.format(**fmt) for s in self.shell.directory_image_handler]
+        self.viewer = subprocess.Popen(args, stdin=subprocess.DEVNULL,
+                                       stdout=subprocess.DEVNULL,
+                                       stderr=subprocess.DEVNULL)
+
+    def show_stream(self, path, imageformat):
+        fmt = dict(format=imageformat)
+        args = [s.format(**fmt) for s in self.shell.stream_image_handler]
+        proc = subprocess.Popen(args, stdin=subprocess.PIPE,
+                                stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL)
+        with open(path, "rb") as f:
+            try:
+                proc.stdin.write(f.read())
+                proc.stdin.close()
+            except OSError:
+                pass
+        self.processes.append(proc)
+
+    def show_tempfile(self, path, imageformat):
+        fmt = dict(file=path, format=imageformat)
+        args = [s.format(**fmt) for s in self.shell.tempfile_image_handler]
+        subprocess.call(args, stdout=subprocess.DEVNULL,
+                        stderr=subprocess.DEVNULL)
+
+    def show_PIL(self, path, imageformat):
+        from PIL import Image, ImageShow
+        with Image.open(path) as img:
+            ImageShow.show(img)
+
+    def stop(self):
+        if self.thread is not None:
+            self.jobs.put(None)
+            self.thread.join(1)
+            self.thread = None
+        for proc in self.processes + [self.viewer]:
+            if proc is not None and proc.poll() is None:
+                proc.terminate()
+        self.processes = []
+        self.viewer = None
+        self.images.clear()
+        if self.path is not None:
+            shutil.rmtree(self.path, ignore_errors=True)
+            self.path = None
+
+
+_pillow = None
+
+
+def pillow_available():
+    global _pillow
+    if _pillow is None:
+        try:
+            import PIL.Image
+            _pillow = True
+        except ImportError:
+            _pillow = False
+    return _pillow
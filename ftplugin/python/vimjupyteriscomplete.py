@@ -0,0 +1,102 @@
+""" Completeness of python code, checked without asking the kernel
+
+RunLine asks whether the lines gathered so far make a complete statement
+before running them. For python kernels, python_is_complete() answers like
+IPython's check_complete does, and only code using IPython syntax (magics,
+shell escapes, help) is left to the kernel's is_complete_request.
+"""
+import codeop
+import io
+import re
+import tokenize
+import warnings
+
+
+# lines the kernel transforms before python sees them
+ipython_syntax = re.compile(r"^\s*[%!?]|\?\s*$|=\s*[%!]", re.M)
+
+skipped_tokens = (tokenize.NEWLINE, tokenize.NL, tokenize.COMMENT,
+                  tokenize.INDENT, tokenize.DEDENT, tokenize.ENDMARKER)
+
+closing_brackets = {")": "(", "]": "[", "}": "{"}
+
+
+def last_indent(lines):
+    for line in reversed(lines):
+        if line.strip():
+            return len(line) - len(line.lstrip())
+    return 0
+
+
+def tokenize_code(code):
+    """ Return the tokens of code, or whether the error ending them leaves
+    an open bracket or string: True if more lines can complete code, False
+    if it is invalid, as with unmatched brackets.
+    """
+    tokens = []
+    # the brackets opened so far, None once a bracket is unmatched
+    brackets = []
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(code).readline):
+            tokens.append(token)
+            if token.type != tokenize.OP or brackets is None:
+                continue
+            if token.string in "([{":
+                brackets.append(token.string)
+            elif token.string in closing_brackets:
+                if brackets and brackets[-1] == closing_brackets[token.string]:
+                    brackets.pop()
+                else:
+                    brackets = None
+    except tokenize.TokenError as error:
+        if "string" in str(error.args[0]):
+            return True
+        return bool(brackets)
+    return tokens
+
+
+def python_is_complete(code):
+    """ Return (more, indent) like VimJupyterShell.check_complete, or None
+    when code has IPython syntax only the kernel can check.
+    """
+    if ipython_syntax.search(code):
+        return None
+    lines = code.splitlines(True)
+    if not lines:
+        return False, ""
+    # IPython removes the indentation of the first line from every line
+    first = lines[0]
+    prefix = first[:len(first) - len(first.lstrip(" \t"))]
+    if prefix:
+        lines = [line[len(prefix):] if line.startswith(prefix) else line
+                 for line in lines]
+    code = "".join(lines)
+    indent = last_indent(lines)
+
+    if code.rstrip("\n").endswith("\\"):
+        return True, " " * indent
+    try:
+        tokens = tokenize_code(code)
+    except SyntaxError:
+        return False, ""
+    if tokens is True:
+        # an open bracket or string
+        return True, " " * indent
+    if tokens is False:
+        # the kernel reports the error when it runs
+        return False, ""
+    meaningful = [t for t in tokens if t.type not in skipped_tokens]
+    if meaningful and meaningful[-1].type == tokenize.OP and \
+            meaningful[-1].string == ":":
+        return True, " " * (indent + 4)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        try:
+            compiled = codeop.compile_command(code, "<cell>", "exec")
+        except (SyntaxError, OverflowError, ValueError):
+            # the kernel reports the error when it runs
+            return False, ""
+    if compiled is None:
+        return True, " " * indent
+    return False, ""
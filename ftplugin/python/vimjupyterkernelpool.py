@@ -0,0 +1,173 @@
+""" Kernels started ahead of time
+
+With g:ipynb_kernel_pool_size set, the kernel_pool keeps that many idle
+kernels of each kernelspec a notebook started, with g:ipynb_kernel_pool_warmup
+run in them (common imports, for instance). Each one takes the memory of a
+running kernel. StartKernel and KernelRestart take a kernel that is ready
+instead of waiting for a new kernel to come up, and the pool starts another
+in the background; while none is ready they start a kernel as they would
+without the pool. Kernels given up are shut down by the same thread, so
+switching kernels does not wait for the old one to exit.
+
+A kernel runs in the directory vim was in when it was started: kernels
+started in another directory than the current one are not handed out.
+"""
+import collections
+import os
+import threading
+import uuid
+
+try:
+    from queue import Queue  # Py 3
+except ImportError:
+    from Queue import Queue  # Py 2
+
+import vim
+
+
+def pool_size():
+    return max(0, int(vim.vars.get("ipynb_kernel_pool_size", 0)))
+
+
+def warmup_code():
+    code = vim.vars.get("ipynb_kernel_pool_warmup", b"")
+    if isinstance(code, bytes):
+        code = code.decode("utf-8")
+    return code
+
+
+class VimJupyterKernelPool():
+
+    def __init__(self, timeout=120):
+        self.timeout = timeout
+        self.condition = threading.Condition()
+        # (kernel_name, cwd) -> KernelManagers ready to be handed out
+        self.ready = collections.defaultdict(list)
+        # (kernel_name, cwd) -> kernels being started
+        self.starting = collections.Counter()
+        # ("start", key, warm-up code), ("dispose", KernelManager) or None
+        self.jobs = Queue()
+        self.thread = None
+        self.closing = False
+
+    def has(self, kernel_name):
+        """ Whether take() would hand out a kernel """
+        key = (kernel_name, os.getcwd())
+        with self.condition:
+            return bool(self.ready[key])
+
+    def take(self, kernel_name):
+        """ A started KernelManager of kernel_name, None if the pool has none
+        ready for the current directory: vim does not wait for a kernel still
+        starting. The pool is filled again either way.
+        """
+        key = (kernel_name, os.getcwd())
+        with self.condition:
+            km = self.ready[key].pop(0) if self.ready[key] else None
+        self.fill(kernel_name)
+        return km
+
+    def fill(self, kernel_name):
+        """ Start kernels of kernel_name until the pool has enough """
+        key = (kernel_name, os.getcwd())
+        code = warmup_code()
+        with self.condition:
+            missing = pool_size() - len(self.ready[key]) - self.starting[key]
+            self.starting[key] += max(0, missing)
+        for _ in range(missing):
+            self.submit(("start", key, code))
+
+    def dispose(self, km):
+        """ Shut km down in the background """
+        self.submit(("dispose", km))
+
+    def submit(self, job):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+        self.jobs.put(job)
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            if job[0] == "start":
+                self.start(*job[1:])
+            elif job[0] == "dispose":
+                self.shutdown_kernel(job[1], now=False)
+
+    def start(self, key, code):
+        kernel_name, cwd = key
+        km = None
+        if self.closing:
+            with self.condition:
+                self.starting[key] -= 1
+                self.condition.notify_all()
+            return
+        try:
+            from jupyter_client import KernelManager
+            from jupyter_client.blocking import BlockingKernelClient
+            from jupyter_core.paths import jupyter_runtime_dir
+            km = KernelManager(
+                kernel_name=kernel_name,
+                connection_file=os.path.join(
+                    jupyter_runtime_dir(),
+                    "kernel-{0}.json".format(uuid.uuid4().hex[:12])))
+            km.client_factory = BlockingKernelClient
+            km.start_kernel(cwd=cwd)
+            self.warm_up(km, code)
+        except Exception:
+            # the notebook starts its kernel itself
+            if km is not None:
+                self.shutdown_kernel(km)
+            km = None
+        if km is not None and self.closing:
+            self.shutdown_kernel(km)
+            km = None
+        with self.condition:
+            self.starting[key] -= 1
+            if km is not None:
+                self.ready[key].append(km)
+            self.condition.notify_all()
+
+    def warm_up(self, km, code):
+        client = km.client()
+        client.start_channels()
+        try:
+            client.wait_for_ready(timeout=self.timeout)
+            if code:
+                msg_id = client.execute(code, silent=True,
+                                        store_history=False)
+                while True:
+                    reply = client.get_shell_msg(timeout=self.timeout)
+                    if reply["parent_header"].get("msg_id") == msg_id:
+                        break
+        finally:
+            client.stop_channels()
+
+    def shutdown_kernel(self, km, now=True):
+        try:
+            if km.has_kernel:
+                km.shutdown_kernel(now=now)
+        except Exception:
+            pass
+
+    def shutdown(self):
+        """ Shut down the idle kernels and those given up, for clean_all """
+        self.closing = True
+        with self.condition:
+            kernels = [km for kms in self.ready.values() for km in kms]
+            self.ready.clear()
+        for km in kernels:
+            self.shutdown_kernel(km)
+        if self.thread is not None:
+            self.jobs.put(None)
+            # a kernel still starting exits with vim, as kernels watch the
+            # process that started them
+            self.thread.join(1)
+            self.thread = None
+
+
+kernel_pool = VimJupyterKernelPool()
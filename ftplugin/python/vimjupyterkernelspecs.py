@@ -0,0 +1,68 @@
+""" Kernelspec discovery shared by every buffer of the vim process
+
+Scanning the kernelspec directories and reading each kernel.json is slow on
+hosts with many environments, so the result is kept until one of the
+directories or kernel.json files changes.
+"""
+import os
+
+
+class VimJupyterKernelSpecs():
+
+    def __init__(self):
+        self.manager = None
+        # kernel name -> {"display_name", "language", "name"}
+        self.specs = {}
+        # language -> kernel names in discovery order
+        self.by_language = {}
+        self.stamp = None
+
+    def _get_stamp(self):
+        """ mtimes of the kernelspec directories and their kernel.json """
+        stamp = []
+        for kernel_dir in self.manager.kernel_dirs:
+            try:
+                stamp.append((kernel_dir, os.stat(kernel_dir).st_mtime_ns))
+                entries = list(os.scandir(kernel_dir))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    stamp.append((entry.path, os.stat(
+                        os.path.join(entry.path, "kernel.json")).st_mtime_ns))
+                except OSError:
+                    pass
+        return tuple(stamp)
+
+    def refresh(self):
+        if self.manager is None:
+            from jupyter_client import kernelspec
+            self.manager = kernelspec.KernelSpecManager()
+        stamp = self._get_stamp()
+        if stamp == self.stamp:
+            return
+        self.specs = {}
+        self.by_language = {}
+        for (name, value) in self.manager.get_all_specs().items():
+            language = value["spec"]["language"]
+            self.specs[name] = {"display_name": value["spec"]["display_name"],
+                                "language": language,
+                                "name": name}
+            self.by_language.setdefault(language, []).append(name)
+        self.stamp = stamp
+
+    def get(self, name="", language=""):
+        """ Return the spec of kernel name if it is installed and runs
+        language, otherwise the first kernel found for language, or None.
+        """
+        self.refresh()
+        spec = self.specs.get(name)
+        if spec is not None and language in ("", spec["language"]):
+            return dict(spec)
+        names = self.by_language.get(language)
+        if names:
+            return dict(self.specs[names[0]])
+        return None
+
+
+kernel_specs = VimJupyterKernelSpecs()
@@ -7,11 +7,17 @@ all vim-ipynb related classes.
 
 import sys
 
-from jupyter_client import kernelspec
+import vim
 
-from vimjupyter import VimJupyter
 from vimjupytershellwrapper import VimJupyterShellWrapper
 from vimipynbformatter import VimIpynbFormatter
+from vimipynbcellindex import on_lines_changed
+from vimipynbblobstore import clear_blob_store
+from vimipynbexporter import export_poll, shutdown_export_worker
+from vimjupyterexecutor import drain_executors
+from vimjupyterkernelpool import kernel_pool
+from vimjupytersharedkernels import shared_kernel_key
+from vimjupyterstartup import show_startup_profile
 
 
 vim_jupyter = dict()
@@ -31,6 +37,8 @@ def launch(name, existing="", kernel_name=""):
     # only launch once, reconnetiong is dealt in other functions
     if name in vim_jupyter:
         return
+    # the kernel client is only imported for the first notebook launched
+    from vimjupyter import VimJupyter
     vim_jupyter[name] = VimJupyter()
     vim_jupyter_formatter[name] = VimIpynbFormatter()
     vim_jupyter_formatter[name].read_ipynb()
@@ -77,7 +85,10 @@ def setup(name, existing=""):
     global vim_jupyter_wrapper
     global vim_jupyter_formatter
     # shuting down the old kernel is done inside initialize
-    vim_jupyter[name].initialize(existing=existing)
+    shared_key = None
+    if not existing:
+        shared_key = shared_kernel_key(name, vim_jupyter[name].kernel_name)
+    vim_jupyter[name].initialize(existing=existing, shared_key=shared_key)
     vim_jupyter_shell[name] = vim_jupyter[name].shell
     vim_jupyter_client[name] = vim_jupyter[name].kernel_client
     vim_jupyter_kernel_manager[name] = vim_jupyter[name].kernel_manager
@@ -88,6 +99,47 @@ def setup(name, existing=""):
     vim_jupyter_wrapper[name] = VimJupyterShellWrapper(
         vim_jupyter_shell[name])
 
+def restart_kernel(name):
+    """ KernelRestart: a kernel of the pool takes the place of the one
+    running, which is shut down in the background
+    """
+    jupyter = vim_jupyter[name]
+    # a shared kernel is restarted for every notebook using it
+    if jupyter.kernel_manager is None or jupyter.shared_kernel is not None \
+            or not kernel_pool.has(jupyter.kernel_name):
+        vim_jupyter_wrapper[name].restart()
+        return
+    shell = vim_jupyter_shell[name]
+    shell.executor.stop()
+    if shell.image_pipeline is not None:
+        shell.image_pipeline.stop()
+    shell.vim_display_manager.close()
+    vim_jupyter_formatter[name].clear_all_output()
+    setup(name)
+    display = vim_jupyter_shell[name].vim_display_manager
+    display.open_window(kind="stdout")
+    display.handle_stdout("Kernel restart!")
+    display.finish_stdout()
+
+def write_notebook(path):
+    """ BufWriteCmd: write the notebook of the current buffer to path.
+    :saveas names the buffer after path before writing it.
+    """
+    buffer = vim.current.buffer
+    name = buffer.name
+    if name not in vim_jupyter_formatter:
+        renamed = [key for key, formatter in vim_jupyter_formatter.items()
+                   if formatter.nb_buffer is not None and
+                   formatter.nb_buffer.number == buffer.number]
+        if not renamed:
+            return
+        for notebooks in (vim_jupyter, vim_jupyter_shell, vim_jupyter_client,
+                          vim_jupyter_formatter, vim_jupyter_wrapper,
+                          vim_jupyter_kernel_manager):
+            if renamed[0] in notebooks:
+                notebooks[name] = notebooks.pop(renamed[0])
+    vim_jupyter_formatter[name].to_ipynb(path)
+
 def print_kernel_name(name):
     global vim_jupyter_formatter
     #print(vim_jupyter_formatter[name].get_kernel_name())
@@ -97,10 +149,22 @@ def get_language(name):
     return vim_jupyter_formatter[name].get_language()
 
 
+def profile_view(action, *args):
+    """ Called from the mappings of the :ProfileCell split """
+    name = vim.current.buffer.vars.get("ipynb_notebook", b"")
+    if isinstance(name, bytes):
+        name = name.decode("utf-8")
+    if name in vim_jupyter_wrapper:
+        view = vim_jupyter_wrapper[name].profile_view
+        if view is not None:
+            getattr(view, action)(*args)
+
+
 def clean_up(name):
     if name in vim_jupyter:
         #if vim_jupyter_wrapper[name] is not None:
         vim_jupyter_wrapper[name].shutdown_silent()
+        vim_jupyter_formatter[name].cell_index.detach()
         del vim_jupyter_wrapper[name]
         del vim_jupyter_kernel_manager[name]
         del vim_jupyter_client[name]
@@ -114,3 +178,6 @@ def clean_all():
         names = list(vim_jupyter.keys())
         for name in names:
             clean_up(name)
+    clear_blob_store()
+    shutdown_export_worker()
+    kernel_pool.shutdown()
@@ -0,0 +1,234 @@
+""" Profiling of a cell in the kernel
+
+:ProfileCell sends the cell under the cursor in a silent execute request,
+which runs it under pyinstrument if the kernel has it, cProfile otherwise.
+Nothing is stored in the history or the outputs of the cell: the profile
+comes back as JSON in the user_expressions of the execute reply, one entry
+[file, line, function, calls, own seconds, cumulative seconds] per function,
+calls None for sampling profilers.
+
+The kernel also names the files ipykernel compiles the other code cells to,
+so the functions defined in any cell of the notebook are found in it. The
+VimJupyterProfileView of the notebook shows the entries in a split.
+"""
+import ast
+import json
+
+import vim
+
+
+profile_file = "<vim-ipynb-profile>"
+
+# run in the kernel, the result is popped from the namespace of the user by
+# the user expression
+profile_source = '''
+def __vim_ipynb_profile(code, sources, filename):
+    import json
+    ip = get_ipython()
+    compiled = compile(ip.transform_cell(code), filename, "exec")
+    entries = []
+    try:
+        from pyinstrument import Profiler
+    except ImportError:
+        Profiler = None
+    if Profiler is None:
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        profiler.runctx(compiled, ip.user_ns, ip.user_ns)
+        stats = pstats.Stats(profiler).stats
+        for (path, line, function), (_, calls, own, total, _) in \\
+                stats.items():
+            entries.append([path, line, function, calls, own, total])
+        kind = "cProfile"
+    else:
+        profiler = Profiler()
+        profiler.start()
+        try:
+            exec(compiled, ip.user_ns, ip.user_ns)
+        finally:
+            session = profiler.stop()
+        found = {}
+
+        def walk(frame, stack):
+            key = (frame.file_path, frame.line_no, frame.function)
+            if frame.file_path is not None:
+                entry = found.setdefault(key, [0.0, 0.0])
+                entry[0] += frame.total_self_time
+                if key not in stack:
+                    # recursive calls are counted once
+                    entry[1] += frame.time
+                stack = stack | {key}
+            for child in frame.children:
+                walk(child, stack)
+
+        def roots(frame):
+            if frame.file_path == filename:
+                walk(frame, frozenset())
+                return
+            for child in frame.children:
+                roots(child)
+        root = session.root_frame()
+        if root is not None:
+            roots(root)
+        for (path, line, function), (own, total) in found.items():
+            entries.append([path, line, function, None, own, total])
+        kind = "pyinstrument"
+    files = []
+    get_code_name = getattr(ip.compile, "get_code_name", None)
+    for source in sources:
+        try:
+            files.append(get_code_name(source, source, 0))
+        except Exception:
+            files.append(None)
+    return json.dumps(dict(profiler=kind, entries=entries, files=files))
+'''
+
+result_name = "__vim_ipynb_profile_result"
+
+
+def profile_request(code, sources):
+    """ Return the code and user_expressions of the execute request
+    profiling code. sources are the code of the other cells, the reply
+    names the file each was compiled to.
+    """
+    request = profile_source + \
+        "{0} = __vim_ipynb_profile({1!r}, {2!r}, {3!r})\n" \
+        "del __vim_ipynb_profile\n".format(
+            result_name, code, sources, profile_file)
+    return request, dict(
+        profile="get_ipython().user_ns.pop({0!r})".format(result_name))
+
+
+def parse_profile(reply):
+    """ The profile of an execute reply, or a message saying why there is
+    none
+    """
+    content = reply["content"] if reply is not None else {}
+    if content.get("status") != "ok":
+        return "The cell did not run to the end, no profile"
+    result = content.get("user_expressions", {}).get("profile", {})
+    if result.get("status") != "ok":
+        return "The kernel could not send the profile back: {0}".format(
+            result.get("evalue", ""))
+    try:
+        return json.loads(ast.literal_eval(result["data"]["text/plain"]))
+    except (KeyError, ValueError, SyntaxError):
+        return "The kernel sent a profile that could not be read"
+
+
+sort_keys = {
+    "cumulative": lambda entry: entry[5],
+    "own": lambda entry: entry[4],
+    "calls": lambda entry: entry[3] or 0,
+}
+
+
+class VimJupyterProfileView():
+    """ The split showing the last profile of a notebook """
+
+    bufwinid = vim.Function("bufwinid")
+    win_gotoid = vim.Function("win_gotoid")
+    cursor = vim.Function("cursor")
+
+    header_lines = 3
+
+    def __init__(self, formatter, notebook):
+        self.formatter = formatter
+        self.notebook = notebook
+        self.buffer_name = notebook + "-Vim-Jupyter-Profile"
+        self.profile = None
+        self.cell = ""
+        # file -> name of the cell compiled to it
+        self.cells = {}
+        self.sort_key = "cumulative"
+        # entries in the order shown
+        self.rows = []
+
+    def show(self, cell, cells, profile):
+        """ Show the profile of cell, cells are the (name, source) sent with
+        it
+        """
+        self.profile = profile
+        self.cell = cell
+        self.cells = {profile_file: cell}
+        for (name, _), path in zip(cells, profile["files"]):
+            if path is not None:
+                self.cells.setdefault(path, name)
+        self.open()
+        self.render()
+
+    def open(self):
+        window = self.bufwinid(self.buffer_name)
+        if window != -1:
+            self.win_gotoid(window)
+            return
+        vim.command("belowright new " + self.buffer_name.replace(" ", "\\ "))
+        vim.command("setlocal buftype=nofile bufhidden=hide noswapfile "
+                    "nowrap nonumber")
+        vim.current.buffer.vars["ipynb_notebook"] = self.notebook
+        for key, args in (("c", ("sort", "cumulative")),
+                          ("o", ("sort", "own")),
+                          ("n", ("sort", "calls")),
+                          ("<CR>", ("jump",))):
+            vim.command("nnoremap <buffer> <silent> {0} "
+                        ":pythonx profile_view({1})<CR>".format(
+                            key, ", ".join(repr(arg) for arg in args)))
+
+    def sort(self, key):
+        self.sort_key = key
+        self.render()
+
+    def location(self, entry):
+        path, line = entry[:2]
+        if path in self.cells:
+            return "cell {0}:{1}".format(self.cells[path], line)
+        if path in ("~", "<built-in>"):
+            # built-in functions
+            return ""
+        return "{0}:{1}".format(path, line)
+
+    def render(self):
+        if self.profile is None:
+            return
+        self.rows = sorted(self.profile["entries"],
+                           key=sort_keys[self.sort_key], reverse=True)
+        total = max([entry[5] for entry in self.rows
+                     if entry[0] == profile_file] or [0])
+        lines = [
+            "{0} of cell {1}: {2:.3f} s, sorted by {3}. c: cumulative, "
+            "o: own, n: calls, <CR>: go to the line".format(
+                self.profile["profiler"], self.cell, total, self.sort_key),
+            "",
+            "{0:>10} {1:>10} {2:>8}  {3}".format(
+                "cumulative", "own", "calls", "function"),
+        ]
+        for entry in self.rows:
+            calls = "-" if entry[3] is None else str(entry[3])
+            lines.append("{0:10.4f} {1:10.4f} {2:>8}  {3}  {4}".format(
+                entry[5], entry[4], calls, entry[2],
+                self.location(entry)).rstrip())
+        buffer = vim.current.buffer
+        buffer.options["modifiable"] = True
+        buffer[:] = lines
+        buffer.options["modifiable"] = False
+        self.cursor(self.header_lines + 1, 1)
+
+    def jump(self):
+        """ Go to the line of the function under the cursor, if it is in a
+        cell of the notebook
+        """
+        index = vim.current.window.cursor[0] - 1 - self.header_lines
+        if not 0 <= index < len(self.rows):
+            return
+        path, line = self.rows[index][:2]
+        entry = self.formatter.cell_index.find(self.cells.get(path))
+        if entry is None or entry.fence is None:
+            vim.command("echo \"Not in a cell of the notebook\"")
+            return
+        window = self.bufwinid(self.notebook)
+        if window == -1:
+            vim.command("echo \"The notebook is not in a window\"")
+            return
+        self.win_gotoid(window)
+        self.cursor(min(entry.begin + 1 + max(line, 1), entry.fence), 1)
@@ -0,0 +1,93 @@
+""" Kernels shared by several notebooks
+
+With b:ipynb_shared_kernel or g:ipynb_shared_kernel set, notebooks of the
+same kernelspec attach to one kernel instead of starting their own:
+"project" shares it between the notebooks of the same project directory, any
+other value is the name of the kernel to share. Each notebook talks to the
+kernel with a session of its own, so the messages of its cells are told apart
+by the session id of their parent header. The kernel is shut down when the
+last notebook attached to it lets it go.
+"""
+import os
+
+import vim
+
+
+# files marking the root directory of a project
+project_markers = (".git", ".hg", "pyproject.toml", "setup.py", "setup.cfg")
+
+
+def project_dir(path):
+    """ The nearest directory above path with a project marker, or the
+    directory of path
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    current = directory
+    while True:
+        if any(os.path.exists(os.path.join(current, marker))
+               for marker in project_markers):
+            return current
+        parent = os.path.dirname(current)
+        if parent == current:
+            return directory
+        current = parent
+
+
+def shared_kernel_key(name, kernel_name):
+    """ The key of the kernel notebook name shares, None if it has a kernel
+    of its own
+    """
+    value = vim.vars.get("ipynb_shared_kernel", b"")
+    for buffer in vim.buffers:
+        if buffer.name == name and "ipynb_shared_kernel" in buffer.vars:
+            value = buffer.vars["ipynb_shared_kernel"]
+    if isinstance(value, bytes):
+        value = value.decode("utf-8")
+    if not value:
+        return None
+    if value == "project":
+        value = "project:" + project_dir(name)
+    return (value, kernel_name)
+
+
+class VimJupyterSharedKernel():
+    """ A kernel and the session ids of the notebooks attached to it """
+
+    def __init__(self, key, kernel_manager):
+        self.key = key
+        self.kernel_manager = kernel_manager
+        self.sessions = set()
+
+    def attach(self, session_id):
+        self.sessions.add(session_id)
+
+    def release(self, session_id):
+        """ Detach session_id, return whether it was the last one and the
+        kernel is to be shut down
+        """
+        if session_id not in self.sessions:
+            return False
+        self.sessions.discard(session_id)
+        if self.sessions:
+            return False
+        if shared_kernels.get(self.key) is self:
+            del shared_kernels[self.key]
+        return True
+
+
+# key -> VimJupyterSharedKernel
+shared_kernels = {}
+
+
+def find_shared_kernel(key):
+    shared = shared_kernels.get(key)
+    if shared is not None and not shared.kernel_manager.is_alive():
+        del shared_kernels[key]
+        shared = None
+    return shared
+
+
+def share_kernel(key, kernel_manager):
+    shared = VimJupyterSharedKernel(key, kernel_manager)
+    shared_kernels[key] = shared
+    return shared
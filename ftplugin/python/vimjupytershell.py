@@ -1,31 +1,30 @@
 """IPython terminal interface using prompt_toolkit in place of readline"""
 from __future__ import print_function
 
-import base64
 import errno
 import sys
-from io import BytesIO
 import os
 import signal
-import subprocess
 import time
+from collections import OrderedDict
 
 try:
     from queue import Empty  # Py 3
 except ImportError:
     from Queue import Empty  # Py 2
 
+import vim
+import zmq
 from zmq import ZMQError
-from IPython.core import page
-from ipython_genutils.tempdir import NamedFileInTemporaryDirectory
 from traitlets import (Bool, Integer, Float, Unicode, List, Dict, Enum,
                        Instance, Any)
 from traitlets.config import SingletonConfigurable, LoggingConfigurable
 
-from jupyter_console.zmqhistory import ZMQHistoryManager
-
 from _version import __version__
 from vimjupyterdisplaymanager import VimJupterDisplayManager
+from vimjupyterexecutor import VimJupyterExecutor, background_enabled
+from vimjupyteriscomplete import python_is_complete
+from vimjupytertrace import VimJupyterTracer
 
 
 class VimJupyterShell(LoggingConfigurable):
@@ -39,6 +38,8 @@ class VimJupyterShell(LoggingConfigurable):
     _pending_clearoutput = False
     _eventloop = None
     own_kernel = False  # Changed by ZMQTerminalIPythonApp
+    # VimJupyterSharedKernel if other notebooks use the kernel, too
+    shared_kernel = None
 
     true_color = Bool(
         False, config=True,
@@ -70,11 +71,12 @@ class VimJupyterShell(LoggingConfigurable):
         """
     )
 
-    vim_display_manager = VimJupterDisplayManager()
+    vim_display_manager = None
+    _tracer = None
     vim_ipynb_formatter = None
 
     image_handler = Enum(
-        ('PIL', 'stream', 'tempfile', 'callable'),
+        ('PIL', 'stream', 'tempfile', 'directory', 'callable'),
         'PIL', config=True, allow_none=True, help="""
         Handler for image type output.  This is useful, for example,
         when connecting to the kernel in which pylab inline backend is
@@ -85,7 +87,10 @@ class VimJupyterShell(LoggingConfigurable):
         `stream_image_handler`; 'tempfile': Use an external program to
         show the image.  Image will be saved in a temporally file and
         the program is called with the temporally file.  You will need
-        to configure `tempfile_image_handler`; 'callable': You can set
+        to configure `tempfile_image_handler`; 'directory': Images are
+        saved in a directory and one program is started on it, to show
+        them as they are added.  You will need to configure
+        `directory_image_handler`; 'callable': You can set
         any Python callable which is called with the image data.  You
         will need to configure `callable_image_handler`.
         """
@@ -112,6 +117,22 @@ class VimJupyterShell(LoggingConfigurable):
         """
     )
 
+    directory_image_handler = List(
+        config=True, help="""
+        Command to invoke an image viewer program when you are using
+        'directory' image handler.  It is started once, on the first
+        image, and again if it exits.  You can use {directory} in the
+        string to represent the directory the images are saved in.
+        """
+    )
+
+    image_thumbnail_size = Integer(
+        1600, config=True, help="""
+        Images larger than this many pixels are shrunk before being
+        shown, if Pillow is installed.  0 shows them as they are.
+        """
+    )
+
     callable_image_handler = Any(
         config=True, help="""
         Callable object called via 'callable' image handler with one
@@ -123,8 +144,10 @@ class VimJupyterShell(LoggingConfigurable):
         """
     )
 
-    image_handler = 'stream'
+    image_handler = 'directory'
     stream_image_handler = ['feh', '--scale-down', '-B', 'white', '-' ]
+    directory_image_handler = ['feh', '--reload', '1', '--scale-down',
+                               '-B', 'white', '{directory}']
 
     mime_preference = List(
         default_value=['image/png', 'image/jpeg', 'image/svg+xml'],
@@ -141,6 +164,16 @@ class VimJupyterShell(LoggingConfigurable):
         own is_complete handler.
         """
     )
+    use_local_is_complete = Bool(
+        True, config=True, help="""
+        Whether to check the completeness of python code in the
+        frontend, asking the kernel only about IPython syntax.
+        """
+    )
+    is_complete_cache_size = Integer(
+        256, config=True,
+        help="How many is_complete verdicts to remember"
+    )
     kernel_is_complete_timeout = Float(
         60, config=True, help="""
         Timeout (in seconds) for giving up on a kernel's is_complete
@@ -152,6 +185,13 @@ class VimJupyterShell(LoggingConfigurable):
         """
     )
 
+    kernel_alive_interval = Float(
+        1, config=True, help="""
+        Interval (in seconds) between checks that the kernel is still alive
+        while a cell runs.
+        """
+    )
+
     confirm_exit = Bool(
         True, config=True, help="""Set to display confirmation dialog on exit.
         You can always use 'exit' or 'quit', to force a
@@ -178,17 +218,32 @@ class VimJupyterShell(LoggingConfigurable):
         # from the values on config.
         super(VimJupyterShell, self).__init__(**kwargs)
         self.configurables = [self]
+        # one output window per notebook
+        self.vim_display_manager = VimJupterDisplayManager()
+        self.executor = VimJupyterExecutor(self)
+        # VimJupyterImagePipeline, made for the first image
+        self.image_pipeline = None
+        # whether the kernel answered since connect or restart, iopub
+        # status messages and the heartbeat keep it up to date
+        self.kernel_ready = False
+        # code -> (more, indent), least recently used first
+        self.is_complete_cache = OrderedDict()
 
-        self.init_history()
         self.init_io()
 
         self.init_kernel_info()
         self.execution_count = 1
 
-    def init_history(self):
-        """Sets up the command history. """
-        self.history_manager = ZMQHistoryManager(client=self.client)
-        self.configurables.append(self.history_manager)
+    _history_manager = None
+
+    @property
+    def history_manager(self):
+        """The command history, set up on first use as it imports IPython"""
+        if self._history_manager is None:
+            from jupyter_console.zmqhistory import ZMQHistoryManager
+            self._history_manager = ZMQHistoryManager(client=self.client)
+            self.configurables.append(self._history_manager)
+        return self._history_manager
 
     kernel_info = {}
 
@@ -209,6 +264,9 @@ class VimJupyterShell(LoggingConfigurable):
             else:
                 if reply['parent_header'].get('msg_id') == msg_id:
                     self.kernel_info = reply['content']
+                    # the kernel answered, no other handshake is needed
+                    # before the first execute
+                    self.kernel_ready = True
                     return
 
     def init_io(self):
@@ -219,8 +277,10 @@ class VimJupyterShell(LoggingConfigurable):
         colorama.init()
 
     def ask_restart(self):
+        self.executor.stop()
         self.vim_display_manager.open_window(kind="stdout")
         self.vim_ipynb_formatter.clear_all_output()
+        self.kernel_ready = False
         if self.manager is not None:
             self.manager.restart_kernel()
             self.vim_display_manager.handle_stdout("Kernel restart!")
@@ -235,22 +295,60 @@ class VimJupyterShell(LoggingConfigurable):
             if choice == 1:
                 return
 
-        if self.manager is not None:
-            self.manager.shutdown_kernel(restart=False)
-        else:
-            self.vim_display_manager.open_window(kind="stdout")
-            self.vim_display_manager.handle_stdout(
-                "Not own the current kernel")
-            self.vim_display_manager.finish_stdout()
-            return
+        self.executor.stop()
+        if self.image_pipeline is not None:
+            self.image_pipeline.stop()
+        try:
+            if self.shared_kernel is not None and \
+                    not self.shared_kernel.release(self.session_id):
+                # only this notebook lets the kernel go
+                self.client.stop_channels()
+                if silent is False:
+                    self.vim_display_manager.open_window(kind="stdout")
+                    self.vim_display_manager.handle_stdout(
+                        "The kernel is still used by {0} other notebook(s)"
+                        .format(len(self.shared_kernel.sessions)))
+                    self.vim_display_manager.finish_stdout()
+                return
+            if self.manager is not None:
+                self.manager.shutdown_kernel(restart=False)
+            else:
+                self.vim_display_manager.open_window(kind="stdout")
+                self.vim_display_manager.handle_stdout(
+                    "Not own the current kernel")
+                self.vim_display_manager.finish_stdout()
+                return
 
-        if silent is False:
-            self.vim_display_manager.open_window(kind="stdout")
-            self.vim_display_manager.handle_stdout(
-                "The kernel has been shut down: "+self.manager.connection_file)
-            self.vim_display_manager.finish_stdout()
+            if silent is False:
+                self.vim_display_manager.open_window(kind="stdout")
+                self.vim_display_manager.handle_stdout(
+                    "The kernel has been shut down: "+self.manager.connection_file)
+                self.vim_display_manager.finish_stdout()
+        finally:
+            # after the last message, which would open a new spill file
+            self.vim_display_manager.close()
 
     def check_complete(self, code):
+        """ Return more, indent for code. Python is checked here, the kernel
+        is only asked about other languages and IPython syntax. Verdicts are
+        cached, as RunLine checks the whole continous_line_buffer again for
+        each line.
+        """
+        verdict = self.is_complete_cache.get(code)
+        if verdict is not None:
+            self.is_complete_cache.move_to_end(code)
+            return verdict
+        if self.use_local_is_complete and self.kernel_info.get(
+                "language_info", {}).get("name") == "python":
+            verdict = python_is_complete(code)
+        if verdict is None:
+            verdict = self.kernel_is_complete(code)
+        self.is_complete_cache[code] = verdict
+        if len(self.is_complete_cache) > self.is_complete_cache_size:
+            self.is_complete_cache.popitem(last=False)
+        return verdict
+
+    def kernel_is_complete(self, code):
         if self.use_kernel_is_complete:
             msg_id = self.client.is_complete(code)
             try:
@@ -310,6 +408,32 @@ class VimJupyterShell(LoggingConfigurable):
 
     continous_line_buffer = ""
 
+    def tracer(self):
+        """ The VimJupyterTracer writing to g:ipynb_trace_file, None when
+        tracing is off
+        """
+        path = vim.vars.get("ipynb_trace_file", b"")
+        if isinstance(path, bytes):
+            path = path.decode("utf-8")
+        if not path:
+            self._tracer = None
+            return None
+        path = os.path.abspath(os.path.expanduser(path))
+        if self._tracer is None or self._tracer.path != path:
+            self._tracer = VimJupyterTracer(path)
+        self._tracer.max_size = int(
+            vim.vars.get("ipynb_trace_file_size", 1048576))
+        return self._tracer
+
+    def interrupt(self):
+        """ Interrupt the cell running in the background and drop the ones
+        queued after it
+        """
+        if self.executor.busy:
+            self.executor.interrupt()
+        elif self.manager is not None:
+            self.manager.interrupt_kernel()
+
     def run_line_abort(self):
         """
         Clear the continous_line_buffer for starting over.
@@ -317,7 +441,7 @@ class VimJupyterShell(LoggingConfigurable):
 
         if self.client.is_alive is False:
             self.vim_display_manager.open_window(kind="stdout")
-            self.handle_iopub()
+            self.drain_iopub()
             self.vim_display_manager.handle_stdout("The kernel is not alive")
             self.vim_display_manager.finish_stdout()
             return
@@ -336,7 +460,7 @@ class VimJupyterShell(LoggingConfigurable):
         """
         if self.client.is_alive is False:
             self.vim_display_manager.open_window(kind="stdout")
-            self.handle_iopub()
+            self.drain_iopub()
             self.vim_display_manager.handle_stdout("The kernel is not alive")
             self.vim_display_manager.finish_stdout()
             return
@@ -367,86 +491,124 @@ class VimJupyterShell(LoggingConfigurable):
           history. For user code calling back into IPython's machinery, this
           should be set to False.
         """
+        self.run_cells([(cell, name)], clear_display, store_history)
 
-        self.vim_display_manager.open_window(
-                kind="stdout", clear_display=clear_display)
-        self.vim_ipynb_formatter.clear_output(name)
-        if (not cell) or cell.isspace():
+    def run_cells(self, cells, clear_display=True, store_history=True):
+        """ Run the (code, name) cells. The execute requests are all sent at
+        once, and the kernel aborts the ones queued after the first error.
+        """
+        code_cells = []
+        for code, name in cells:
+            if (not code) or code.isspace():
+                self.vim_ipynb_formatter.clear_output(name)
+            else:
+                code_cells.append((code, name))
+        if code_cells:
+            self.execute(code_cells, clear_display, store_history)
+        elif not background_enabled():
             # pressing enter flushes any pending display
-            self.handle_iopub()
+            self.vim_display_manager.open_window(
+                    kind="stdout", clear_display=clear_display)
+            self.drain_iopub()
             self.vim_display_manager.finish_stdout()
+
+    def execute(self, cells, clear_display=True, store_history=True,
+                **options):
+        """ Send the (code, name) cells and handle the messages of the kernel
+        until they are done, or leave that to the timers in background mode.
+        options are the silent, user_expressions and on_reply arguments of
+        VimJupyterExecutor.submit.
+        """
+        if background_enabled():
+            self.executor.submit(cells, clear_display, store_history,
+                                 **options)
             return
 
+        self.vim_display_manager.open_window(
+                kind="stdout", clear_display=clear_display)
         if self.client.is_alive() is False:
-            self.handle_iopub()
+            self.kernel_ready = False
+            self.drain_iopub()
             self.vim_display_manager.handle_stdout("The kernel is not alive")
             self.vim_display_manager.finish_stdout()
             return
 
-        # flush stale replies, which could have been ignored,
-        # due to missed heartbeats
-
-        self.client.wait_for_ready()
-
-        # execute takes 'hidden', which is the inverse of store_hist
-        msg_id = self.client.execute(cell, not store_history)
-
-        # first thing is wait for any side effects (output, stdin, etc.)
-        self._executing = True
-        self._execution_state = "busy"
-        while self._execution_state != 'idle' and self.client.is_alive():
+        # the full handshake only after connect, restart or a missed
+        # heartbeat, stale replies are told apart by msg_id anyway
+        if not self.kernel_ready:
+            self.client.wait_for_ready()
+            self.kernel_ready = True
+
+        self.executor.submit(cells, clear_display, store_history,
+                             background=False, **options)
+        # wait for side effects (output, stdin, etc.) and the execute
+        # replies, handling each message as soon as it arrives
+        channels = [(self.client.iopub_channel, "iopub"),
+                    (self.client.stdin_channel, "stdin"),
+                    (self.client.shell_channel, "shell")]
+        poller = zmq.Poller()
+        for channel, _ in channels:
+            poller.register(channel.socket, zmq.POLLIN)
+        while self.executor.requests:
+            timeout = max(0, self.executor.next_check - time.monotonic())
+            flush = self.vim_display_manager.flush_timeout()
+            if flush is not None:
+                timeout = min(timeout, flush)
             try:
-                self.handle_input_request(msg_id, timeout=0.05)
-            except Empty:
-                # display intermediate print statements, etc.
-                self.handle_iopub(msg_id, name)
+                events = dict(poller.poll(timeout * 1000))
             except ZMQError as e:
                 # Carry on if polling was interrupted by a signal
                 if e.errno != errno.EINTR:
                     raise
-
-        # after all of that is done, wait for the execute reply
-
-        while self.client.is_alive():
-            try:
-                self.handle_execute_reply(msg_id, name, timeout=0.05)
-                break
-            except Empty:
-                break
-                pass
-            else:
-                break
-        self._executing = False
+                continue
+            for channel, kind in channels:
+                if channel.socket in events:
+                    while channel.msg_ready() and self.executor.requests:
+                        self.executor.dispatch(
+                            kind, channel.get_msg(timeout=0))
+            self.executor.check_alive()
+            self.executor.render()
         self.vim_display_manager.finish_stdout()
+        self.executor.rendered()
+        self.executor.run_callbacks()
 
     # -----------------
     # message handlers
     # -----------------
 
     def handle_execute_reply(self, msg_id, name="", timeout=None):
+        """ Handle a message of the shell channel, return whether it was the
+        reply to msg_id.
+        """
         msg = self.client.get_shell_msg(timeout=timeout)
-        if msg["parent_header"].get("msg_id", None) == msg_id:
+        return self.dispatch_execute_reply(msg, msg_id, name)
 
-            content = msg["content"]
-            status = content['status']
-            if status == 'aborted':
-                self.write('Aborted\n')
-                return
-            elif status == 'ok':
-                # handle payloads
-                for item in content.get("payload", []):
-                    source = item['source']
-                    if source == 'page':
-                        page.page(item['data']['text/plain'])
-                    elif source == 'set_next_input':
-                        self.next_input = item['text']
-                    elif source == 'ask_exit':
-                        self.keepkernel = item.get('keepkernel', False)
-
-            elif status == 'error':
-                pass
-
-            self.execution_count = int(content["execution_count"] + 1)
+    def dispatch_execute_reply(self, msg, msg_id, name=""):
+        if msg["parent_header"].get("msg_id", None) != msg_id:
+            return False
+
+        content = msg["content"]
+        status = content['status']
+        if status == 'aborted':
+            self.vim_display_manager.handle_stdout('Aborted')
+            return True
+        elif status == 'ok':
+            # handle payloads
+            for item in content.get("payload", []):
+                source = item['source']
+                if source == 'page':
+                    from IPython.core import page
+                    page.page(item['data']['text/plain'])
+                elif source == 'set_next_input':
+                    self.next_input = item['text']
+                elif source == 'ask_exit':
+                    self.keepkernel = item.get('keepkernel', False)
+
+        elif status == 'error':
+            pass
+
+        self.execution_count = int(content["execution_count"] + 1)
+        return True
 
     include_other_output = Bool(
         False, config=True,
@@ -472,6 +634,9 @@ class VimJupyterShell(LoggingConfigurable):
     def include_output(self, msg):
         """Return whether we should include a given output message"""
         from_here = self.from_here(msg)
+        if self.shared_kernel is not None and not from_here:
+            # the cells of the other notebooks sharing the kernel
+            return False
         if msg['msg_type'] == 'execute_input':
             # echo inputs not from here
             return not from_here
@@ -481,6 +646,11 @@ class VimJupyterShell(LoggingConfigurable):
         else:
             return from_here
 
+    def drain_iopub(self, msg_id='', name=""):
+        """ Handle the IOPub messages already received, without waiting """
+        while self.client.iopub_channel.msg_ready():
+            self.handle_iopub(msg_id, name)
+
 # need to redirect
     def handle_iopub(self, msg_id='', name=""):
         """Process messages on the IOPub channel
@@ -491,13 +661,13 @@ class VimJupyterShell(LoggingConfigurable):
            It only displays output that is caused by this session.
         """
 
-        output_handler = self.vim_display_manager.handle_stdout
-        output_prompt = self.vim_display_manager.handle_prompt
-        clear_buffer = self.vim_display_manager.clear_stdout_buffer
-
-
         # get io channel blocking
         sub_msg = self.client.get_iopub_msg()
+        self.dispatch_iopub(sub_msg, name)
+
+    def dispatch_iopub(self, sub_msg, name=""):
+        output_handler = self.vim_display_manager.handle_stdout
+        output_prompt = self.vim_display_manager.handle_prompt
 
         msg_type = sub_msg['header']['msg_type']
         # parent = sub_msg["parent_header"]
@@ -507,15 +677,19 @@ class VimJupyterShell(LoggingConfigurable):
             self.execution_count = int(
                 sub_msg["content"]["execution_count"]) + 1
 
+        if msg_type == 'status':
+            # any status shows iopub is connected, starting a restart
+            self.kernel_ready = \
+                sub_msg["content"]["execution_state"] != "starting"
+
         if self.include_output(sub_msg):
             if msg_type == 'status':
                 self._execution_state = \
                         sub_msg["content"]["execution_state"]
             elif msg_type == 'stream':
+                if self._pending_clearoutput:
+                    self.clear_display(name)
                 if sub_msg["content"]["name"] == "stdout":
-                    if self._pending_clearoutput:
-                        clear_buffer()
-                        self._pending_clearoutput = False
                     output_prompt(
                             "\nOut[{}]: ".format(self.execution_count))
                     output_handler(
@@ -523,9 +697,6 @@ class VimJupyterShell(LoggingConfigurable):
                     self.vim_ipynb_formatter.embed_output(
                             name, sub_msg)
                 elif sub_msg["content"]["name"] == "stderr":
-                    if self._pending_clearoutput:
-                        clear_buffer()
-                        self._pending_clearoutput = False
                     output_handler(
                         sub_msg["content"]["text"])
                     self.vim_ipynb_formatter.embed_output(
@@ -533,8 +704,7 @@ class VimJupyterShell(LoggingConfigurable):
 
             elif msg_type == 'execute_result':
                 if self._pending_clearoutput:
-                    clear_buffer()
-                    self._pending_clearoutput = False
+                    self.clear_display(name)
                 self.execution_count = int(
                     sub_msg["content"]["execution_count"])
                 self.vim_ipynb_formatter.embed_output(
@@ -558,6 +728,8 @@ class VimJupyterShell(LoggingConfigurable):
                 output_handler(text_repr)
 
             elif msg_type == 'display_data':
+                if self._pending_clearoutput:
+                    self.clear_display(name)
                 data = sub_msg["content"]["data"]
                 handled = self.handle_rich_data(data)
                 self.vim_ipynb_formatter.embed_output(
@@ -585,15 +757,24 @@ class VimJupyterShell(LoggingConfigurable):
                 if sub_msg["content"]["wait"]:
                     self._pending_clearoutput = True
                 else:
-                    clear_buffer()
-                    self.vim_ipynb_formatter.clear_output()
+                    self.clear_display(name)
 
             elif msg_type == 'error':
+                if self._pending_clearoutput:
+                    self.clear_display(name)
                 for frame in sub_msg["content"]["traceback"]:
                     output_handler(frame)
                 self.vim_ipynb_formatter.embed_output(
                                         name, sub_msg)
 
+    def clear_display(self, name):
+        """ Clear the output window and the outputs of cell name. Only the
+        latest frame is kept, see VimJupterDisplayManager.clear_frame.
+        """
+        self._pending_clearoutput = False
+        self.vim_display_manager.clear_frame()
+        self.vim_ipynb_formatter.clear_output(name)
+
     _imagemime = {
         'image/png': 'png',
         'image/jpeg': 'jpeg',
@@ -608,54 +789,13 @@ class VimJupyterShell(LoggingConfigurable):
         return False
 
     def handle_image(self, data, mime):
-        handler = getattr(
-            self, 'handle_image_{0}'.format(self.image_handler), None)
-        if handler:
-            return handler(data, mime)
-
-    def handle_image_PIL(self, data, mime):
-        if mime not in ('image/png', 'image/jpeg'):
-            return False
-        try:
-            from PIL import Image, ImageShow
-        except ImportError:
-            return False
-        #raw = base64.b64decode(data[mime].encode('ascii'))
-        raw = base64.decodebytes(data[mime].encode('ascii'))
-        img = Image.open(BytesIO(raw))
-        return ImageShow.show(img)
-
-    def handle_image_stream(self, data, mime):
-        #raw = base64.b64decode(data[mime].encode('ascii'))
-        raw = base64.decodebytes(data[mime].encode('ascii'))
-        imageformat = self._imagemime[mime]
-        fmt = dict(format=imageformat)
-        args = [s.format(**fmt) for s in self.stream_image_handler]
-        with open(os.devnull, 'w') as devnull:
-            proc = subprocess.Popen(
-                args, stdin=subprocess.PIPE,
-                stdout=None, stderr=None)
-            try:
-                proc.communicate(raw , timeout=0.5)
-            except :
-                pass
-
-        #return (proc.returncode == 0)
-        return True
-
-    def handle_image_tempfile(self, data, mime):
-        #raw = base64.b64decode(data[mime].encode('ascii'))
-        raw = base64.decodebytes(data[mime].encode('ascii'))
-        imageformat = self._imagemime[mime]
-        filename = 'tmp.{0}'.format(imageformat)
-        with NamedFileInTemporaryDirectory(filename) as f, \
-                open(os.devnull, 'w') as devnull:
-            f.write(raw)
-            f.flush()
-            fmt = dict(file=f.name, format=imageformat)
-            args = [s.format(**fmt) for s in self.tempfile_image_handler]
-            rc = subprocess.call(args, stdout=devnull, stderr=devnull)
-        return (rc == 0)
+        if self.image_handler == 'callable':
+            return self.handle_image_callable(data, mime)
+        # decoded and shown by the thread of the pipeline
+        if self.image_pipeline is None:
+            from vimjupyterimages import VimJupyterImagePipeline
+            self.image_pipeline = VimJupyterImagePipeline(self)
+        return self.image_pipeline.submit(data[mime], mime)
 
     def handle_image_callable(self, data, mime):
         res = self.callable_image_handler(data)
@@ -666,12 +806,20 @@ class VimJupyterShell(LoggingConfigurable):
             res = True
         return res
 
-    def handle_input_request(self, msg_id, timeout=0.1):
+    def handle_input_request(self, msg_id, name="", timeout=0.1):
         """ Method to capture raw_input
         """
         req = self.client.get_stdin_msg(timeout=timeout)
         # in case any iopub came while we were waiting:
-        self.handle_iopub(msg_id)
+        self.drain_iopub(msg_id, name)
+        raw_data = self.read_input(req, msg_id)
+        if raw_data is not None:
+            self.client.input(raw_data)
+
+    def read_input(self, req, msg_id):
+        """ Ask the user for the input requested by req, return None if
+        req is not for msg_id or the user interrupted it.
+        """
         if msg_id == req["parent_header"].get("msg_id"):
             # wrap SIGINT handler
             real_handler = signal.getsignal(signal.SIGINT)
@@ -698,7 +846,5 @@ class VimJupyterShell(LoggingConfigurable):
             finally:
                 # restore SIGINT handler
                 signal.signal(signal.SIGINT, real_handler)
-            # only send stdin reply if there *was not* another request
-            # or execution finished while we were reading.
-            self.client.wait_for_ready()
-            self.client.input(raw_data)
+            return raw_data
+        return None
@@ -1,11 +1,13 @@
 import vim
-import re
 import sys
 
+from vimjupytertrace import trace_summary
+from vimjupyterprofile import (VimJupyterProfileView, profile_request,
+                               parse_profile)
+
 
 getline = vim.Function('getline')
 cursor = vim.Function('cursor')
-search = vim.Function('search')
 
 """
 Class for handling get code for shell to send to kernel from vim buffer.
@@ -14,21 +16,33 @@ class VimJupyterShellWrapper():
 
     shell = None
     vim_ipynb_formatter = None
+    profile_view = None
 
     def __init__(self, shell):
         self.shell = shell
         self.vim_ipynb_formatter = shell.vim_ipynb_formatter
 
+    def code_cell_at(self, pos):
+        """ Return the index entry of the code cell under pos, or None """
+        row = pos[0] - 1
+        entry = self.vim_ipynb_formatter.cell_index.cell_at(row)
+        if entry is None or entry.cell_type != "code" or \
+                entry.fence is None or not entry.begin < row < entry.fence:
+            return None
+        return entry
+
     def in_cell(self, pos):
-        cursor(pos[0], pos[1])
-        row_finish = search(r"^```\s*$", "cW")
-        row_begin = search(r"^```\w\+", "bcW")
-        cursor(pos[0], pos[1])
-        if row_finish <= pos[0] or row_begin >= pos[0]:
+        if self.code_cell_at(pos) is None:
             vim.command("echo \"Not inside a code cell\"")
             return False
         return True
 
+    def cell_code(self, entry):
+        code = ""
+        for line in vim.current.buffer[entry.begin+1:entry.fence]:
+            code += line + "\n"
+        return code
+
     def run_line(self):
         pos = vim.current.window.cursor
         if self.in_cell(pos) is False:
@@ -45,49 +59,68 @@ class VimJupyterShellWrapper():
     def run_cell_under_cursor(self, down=False):
         vim.command(":write")
         pos = vim.current.window.cursor
-        cursor(pos)
-        row_finish = search(r"^```\s*$", "cW")
-        row_begin = search(r"^```\w\+", "bcW")
-        code = ""
-
         if self.in_cell(pos) is False:
             return None
-        cell = vim.current.buffer[row_begin:row_finish-1]
-        for line in cell:
-            code += line + "\n"
+        entry = self.code_cell_at(pos)
+        code = self.cell_code(entry)
 
-        if down is False:
-            cursor(pos[0], pos[1])
-        else:
-            cursor(row_finish-1, pos[1])
+        if down is True:
+            cursor(entry.fence, pos[1])
 
-        name = re.match(r"^```.*?\s+(.*?)[\s$]",
-                        vim.current.buffer[row_begin-1] + '\n').group(1)
-        self.shell.run_cell(code, name, store_history=True)
+        self.shell.run_cell(code, entry.name, store_history=True)
 
     def run_cell(self, arg=""):
-        code = ""
-        pos = vim.current.window.cursor
-        row_begin = search("^```"
-                           + self.vim_ipynb_formatter.kernel_language
-                           + r"\s"+arg+r"[\s\n]", "c")
-        if row_begin == 0:
+        entry = self.vim_ipynb_formatter.cell_index.find(arg)
+        if entry is None or entry.cell_type != "code" or entry.fence is None:
             vim.command("echo \"Cannot find a code cell named " + arg + "\"")
             return
-        row_finish = search(r"^```\s*$", "cW")
-        cell = vim.current.buffer[row_begin: row_finish-1]
-        for line in cell:
-            code += line + "\n"
-        cursor(pos[0], pos[1])
-        self.shell.run_cell(code, arg, store_history=True)
+        self.shell.run_cell(self.cell_code(entry), arg, store_history=True)
 
     def run_all(self):
         self.vim_ipynb_formatter.update_from_buffer()
-        cells = self.vim_ipynb_formatter.vim_ipynb_cells
-        for name in cells:
-            if cells[name]['cell_type'] == "code":
-                self.shell.run_cell(cells[name]['source'], name,
-                                    clear_display=False, store_history=True)
+        self.shell.run_cells(
+            [(cell.source, cell.name)
+             for cell in self.vim_ipynb_formatter.vim_ipynb_cells
+             if cell.cell_type == "code"],
+            clear_display=False, store_history=True)
+
+    def profile_cell(self):
+        """ Profile the cell under the cursor in the kernel, without touching
+        its outputs, and show the hot functions in a split
+        """
+        pos = vim.current.window.cursor
+        if self.in_cell(pos) is False:
+            return
+        if self.shell.kernel_info.get("language_info", {}).get(
+                "name") != "python":
+            vim.command("echo \"Only cells of python kernels are profiled\"")
+            return
+        entry = self.code_cell_at(pos)
+        code = self.cell_code(entry)
+        # the kernel names the file each cell was compiled to, the code sent
+        # by RunAll has no trailing newline
+        cells = []
+        for cell in self.vim_ipynb_formatter.cell_index.cells():
+            if cell.cell_type == "code" and cell.fence is not None:
+                source = self.cell_code(cell)
+                cells.append((cell.name, source))
+                cells.append((cell.name, source.rstrip("\n")))
+        if self.profile_view is None:
+            self.profile_view = VimJupyterProfileView(
+                self.vim_ipynb_formatter, vim.current.buffer.name)
+        name = entry.name
+
+        def show(reply):
+            profile = parse_profile(reply)
+            if isinstance(profile, dict):
+                self.profile_view.show(name, cells, profile)
+            else:
+                vim.command("echo \"" + profile + "\"")
+
+        request, user_expressions = profile_request(
+            code, [source for _, source in cells])
+        self.shell.execute([(request, "")], store_history=False, silent=True,
+                           user_expressions=user_expressions, on_reply=show)
 
     def print_variable(self, arg=""):
         pos = vim.current.window.cursor
@@ -125,3 +158,45 @@ class VimJupyterShellWrapper():
 
     def restart(self):
         self.shell.ask_restart()
+
+    def interrupt(self):
+        self.shell.interrupt()
+
+    def output_log(self):
+        self.shell.vim_display_manager.open_spill()
+
+    def trace_summary(self):
+        """ Show the percentiles of the latency traced to g:ipynb_trace_file
+        """
+        display = self.shell.vim_display_manager
+        tracer = self.shell.tracer()
+        if tracer is None:
+            vim.command("echo \"Set g:ipynb_trace_file to trace cells\"")
+            return
+        display.open_window(kind="stdout")
+        for line in trace_summary(tracer.path):
+            display.handle_stdout(line)
+        display.finish_stdout()
+
+    def kernel_stats(self, count=10):
+        """ Show the slowest cells and the kernel busy time of the notebook,
+        from the execution metadata of the cells
+        """
+        self.vim_ipynb_formatter.update_from_buffer()
+        times = self.vim_ipynb_formatter.execution_times()
+        display = self.shell.vim_display_manager
+        display.open_window(kind="stdout")
+        busy = sum(kernel for _, kernel, _, _ in times)
+        display.handle_stdout("Kernel busy {0:.3f} s over {1} cell(s)".format(
+            busy, len(times)))
+        if times:
+            display.handle_stdout("Slowest cells:")
+        times.sort(key=lambda t: t[1], reverse=True)
+        for name, kernel, total, size in times[:count]:
+            line = "  {0:<12} {1:9.3f} s".format(name, kernel)
+            if total is not None:
+                line += "  shown after {0:.3f} s".format(total)
+            if size is not None:
+                line += "  {0} chars of output".format(size)
+            display.handle_stdout(line)
+        display.finish_stdout()
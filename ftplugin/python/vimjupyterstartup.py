@@ -0,0 +1,183 @@
+""" Import times of the plugin, for :JupyterStartupProfile
+
+ftplugin/ipynb.vim times its startup phases (importing the plugin, opening
+the notebook) with startup_phase(). The import_timer, put first in
+sys.meta_path, times every module loaded from then on like python -X
+importtime does: the time spent executing the module itself, and with the
+modules it imports. It leaves sys.meta_path once the first notebook is open.
+With g:ipynb_time_imports set it stays, and the modules the plugin only
+imports on first use (the kernel client, IPython's pager, image handlers)
+show up as they are loaded.
+
+Only the standard library is imported here, the timer has to come first.
+"""
+import contextlib
+import sys
+import threading
+import time
+
+import vim
+
+
+# imports under this many seconds are left out of the report
+report_threshold = 0.001
+
+
+class VimJupyterTimedLoader():
+    """ Stands for the loader of one spec while its module is executed,
+    the module gets the loader back once it is loaded
+    """
+
+    def __init__(self, timer, name, loader):
+        self.timer = timer
+        self.name = name
+        self.loader = loader
+
+    def __getattr__(self, attribute):
+        return getattr(self.loader, attribute)
+
+    def create_module(self, spec):
+        create_module = getattr(self.loader, "create_module", None)
+        if create_module is None:
+            return None
+        return create_module(spec)
+
+    def exec_module(self, module):
+        try:
+            self.timer.timed(self.name, self.loader.exec_module, module)
+        finally:
+            if getattr(module, "__loader__", None) is self:
+                module.__loader__ = self.loader
+            spec = getattr(module, "__spec__", None)
+            if spec is not None and spec.loader is self:
+                spec.loader = self.loader
+
+
+class VimJupyterImportTimer():
+    """ Meta path finder handing out the specs of the other finders, with
+    a VimJupyterTimedLoader timing the execution of their module
+    """
+
+    def __init__(self):
+        # [name, depth, self seconds, cumulative seconds, started], in the
+        # order the imports started
+        self.records = []
+        # per thread, the time spent in nested imports at each depth
+        self.local = threading.local()
+
+    def find_spec(self, name, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self:
+                continue
+            find_spec = getattr(finder, "find_spec", None)
+            if find_spec is None:
+                continue
+            spec = find_spec(name, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        # built-in and frozen modules have classes as loaders, quick to
+        # load anyway
+        if spec.loader is not None and not isinstance(spec.loader, type) \
+                and hasattr(spec.loader, "exec_module"):
+            spec.loader = VimJupyterTimedLoader(self, name, spec.loader)
+        return spec
+
+    def timed(self, name, exec_module, module):
+        nested = getattr(self.local, "nested", None)
+        if nested is None:
+            nested = self.local.nested = [0.0]
+        start = time.perf_counter()
+        record = [name, len(nested) - 1, 0.0, 0.0, start]
+        self.records.append(record)
+        nested.append(0.0)
+        try:
+            exec_module(module)
+        finally:
+            total = time.perf_counter() - start
+            record[2] = total - nested.pop()
+            record[3] = total
+            nested[-1] += total
+
+    def installed(self):
+        return self in sys.meta_path
+
+    def install(self):
+        if not any(isinstance(finder, VimJupyterImportTimer)
+                   for finder in sys.meta_path):
+            sys.meta_path.insert(0, self)
+
+    def uninstall(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+
+import_timer = VimJupyterImportTimer()
+import_timer.install()
+
+# (label, start, end, whether imports were timed) of the startup phases
+phases = []
+
+
+@contextlib.contextmanager
+def startup_phase(label):
+    timed = import_timer.installed()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases.append((label, start, time.perf_counter(), timed))
+
+
+def startup_done():
+    """ Stop timing imports once the first notebook is open, unless
+    g:ipynb_time_imports asks to time those done on first use too
+    """
+    if not int(vim.vars.get("ipynb_time_imports", 0)):
+        import_timer.uninstall()
+
+
+def import_lines(records):
+    lines = []
+    for name, depth, own, total, _ in records:
+        if total >= report_threshold:
+            lines.append("{0:9.1f} {1:9.1f}  {2}{3}".format(
+                own * 1000, total * 1000, "  " * depth, name))
+    return lines
+
+
+def startup_profile():
+    """ Lines reporting the startup phases and the imports done on first
+    use, in milliseconds
+    """
+    records = list(import_timer.records)
+    lines = ["Startup of the plugin, imports over {0:.0f} ms".format(
+        report_threshold * 1000), ""]
+    header = "{0:>9} {1:>9}  {2}".format("self ms", "cumul ms", "module")
+    in_phase = set()
+    for label, start, end, timed in phases:
+        phase = [record for record in records if start <= record[4] <= end]
+        in_phase.update(id(record) for record in phase)
+        if timed:
+            lines.append("{0}: {1:.1f} ms, {2} module(s) imported".format(
+                label, (end - start) * 1000, len(phase)))
+        else:
+            lines.append("{0}: {1:.1f} ms".format(
+                label, (end - start) * 1000))
+    for label, start, end, _ in phases:
+        phase = [record for record in records if start <= record[4] <= end]
+        if import_lines(phase):
+            lines.extend(["", label, header] + import_lines(phase))
+    later = [record for record in records if id(record) not in in_phase]
+    if later:
+        lines.extend(["", "Imported on first use", header] +
+                     import_lines(later))
+    return lines
+
+
+def show_startup_profile():
+    vim.command("belowright new Vim-Jupyter-Startup-Profile")
+    vim.command("setlocal buftype=nofile bufhidden=wipe noswapfile nowrap")
+    vim.current.buffer[:] = startup_profile()
+    vim.command("setlocal nomodifiable")
@@ -0,0 +1,167 @@
+""" Latency tracing of the execute requests
+
+With g:ipynb_trace_file set, each cell run writes one JSON line to that
+file: the time of each hop from the execute request being sent to the
+frontend being done with it, in milliseconds after the request was sent.
+A hop is [name, received, handled]: name is the message type of the kernel
+message, or sent, rendered and done for the frontend steps. The file is
+rotated once above g:ipynb_trace_file_size bytes.
+
+frontend_ms is the time the cell took minus the time the kernel spent
+running it and queued_ms, the time from the request being sent to the kernel
+starting it, by the clock of the kernel. handle_ms is the time spent handling
+its messages. The requests of the plugin itself, not run for a cell (such as
+:ProfileCell), are not traced.
+"""
+import json
+import math
+import os
+import time
+
+
+trace_backups = 3
+
+
+def percentile(values, p):
+    """ Nearest rank percentile of sorted values """
+    if not values:
+        return None
+    rank = max(1, int(math.ceil(p / 100.0 * len(values))))
+    return values[rank - 1]
+
+
+def kernel_seconds(started, replied):
+    from jupyter_client.jsonutil import parse_date
+    if isinstance(started, str):
+        started = parse_date(started)
+    if isinstance(replied, str):
+        replied = parse_date(replied)
+    try:
+        return (replied - started).total_seconds()
+    except TypeError:
+        return None
+
+
+def kernel_timestamp(date):
+    """ Seconds since the epoch of a date sent by the kernel, or None """
+    from jupyter_client.jsonutil import parse_date
+    if isinstance(date, str):
+        date = parse_date(date)
+    try:
+        return date.timestamp()
+    except AttributeError:
+        return None
+
+
+class VimJupyterTracer():
+
+    def __init__(self, path, max_size=1048576):
+        self.path = path
+        self.max_size = max_size
+        # msg_id -> trace being recorded
+        self.traces = {}
+
+    def start(self, msg_id, name):
+        if not name:
+            return
+        self.traces[msg_id] = dict(
+            cell=name, msg_id=msg_id, sent=time.time(), hops=[],
+            start=time.monotonic(), handle=0.0, kernel_ms=None,
+            queued_ms=None)
+        self.hop(msg_id, "sent")
+
+    def ms(self, trace, t):
+        return round((t - trace["start"]) * 1000, 3)
+
+    def hop(self, msg_id, name, received=None, handled=None, msg=None):
+        trace = self.traces.get(msg_id)
+        if trace is None:
+            return
+        now = time.monotonic()
+        if received is None:
+            received = now
+        if handled is None:
+            handled = now
+        else:
+            trace["handle"] += handled - received
+        trace["hops"].append([name, self.ms(trace, received),
+                              self.ms(trace, handled)])
+        if name == "execute_reply" and msg is not None:
+            started = msg["metadata"].get("started")
+            seconds = kernel_seconds(started, msg["header"].get("date"))
+            if seconds is not None:
+                trace["kernel_ms"] = round(seconds * 1000, 3)
+            started = kernel_timestamp(started)
+            if started is not None:
+                trace["queued_ms"] = round(
+                    max(0, started - trace["sent"]) * 1000, 3)
+
+    def rendered(self, msg_ids):
+        for msg_id in msg_ids:
+            self.hop(msg_id, "rendered")
+
+    def finish(self, msg_id):
+        self.hop(msg_id, "done")
+        trace = self.traces.pop(msg_id, None)
+        if trace is None:
+            return
+        total = trace["hops"][-1][2]
+        queued = trace["queued_ms"]
+        kernel = trace["kernel_ms"]
+        line = dict(cell=trace["cell"], msg_id=msg_id, sent=trace["sent"],
+                    total_ms=total, queued_ms=queued, kernel_ms=kernel,
+                    frontend_ms=None if kernel is None or queued is None
+                    else round(total - queued - kernel, 3),
+                    handle_ms=round(trace["handle"] * 1000, 3),
+                    hops=trace["hops"])
+        self.write(json.dumps(line))
+
+    def write(self, line):
+        try:
+            if os.path.getsize(self.path) > self.max_size:
+                self.rotate()
+        except OSError:
+            pass
+        with open(self.path, "a") as f:
+            f.write(line + "\n")
+
+    def rotate(self):
+        for n in range(trace_backups - 1, 0, -1):
+            if os.path.exists("{0}.{1}".format(self.path, n)):
+                os.replace("{0}.{1}".format(self.path, n),
+                           "{0}.{1}".format(self.path, n + 1))
+        os.replace(self.path, self.path + ".1")
+
+
+def read_traces(path):
+    """ The traces of path and of its rotated files, oldest first """
+    traces = []
+    paths = ["{0}.{1}".format(path, n) for n in range(trace_backups, 0, -1)]
+    for name in paths + [path]:
+        try:
+            with open(name) as f:
+                for line in f:
+                    try:
+                        traces.append(json.loads(line))
+                    except ValueError:
+                        pass
+        except OSError:
+            continue
+    return traces
+
+
+def trace_summary(path):
+    """ Lines with the p50, p95 and p99 of the traces of path """
+    traces = read_traces(path)
+    lines = ["{0} traced cell(s) in {1}".format(len(traces), path)]
+    for key, label in (("frontend_ms", "frontend overhead"),
+                       ("handle_ms", "message handling"),
+                       ("kernel_ms", "kernel"),
+                       ("total_ms", "total")):
+        values = sorted(t[key] for t in traces if t.get(key) is not None)
+        if not values:
+            continue
+        lines.append("  {0:<18} p50 {1:9.3f}  p95 {2:9.3f}  p99 {3:9.3f} ms"
+                     .format(label, percentile(values, 50),
+                             percentile(values, 95), percentile(values, 99)))
+    return lines